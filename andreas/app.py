@@ -1,3 +1,5 @@
+from typing import List
+
 from flask import Config
 from flask.app import Flask
 
@@ -9,6 +11,35 @@ class AndreasConfig(Config):
         user: str
         password: str
         database: str
+        
+        pool: bool = False
+        """Keep a pool of open connections instead of opening a new one every time."""
+        max_connections: int = 20
+        """Maximum number of connections in the pool, both used and idle."""
+        stale_timeout: int = 300
+        """Idle connections older than this number of seconds are closed instead of being reused."""
+        timeout: int = 10
+        """How many seconds to wait for a free connection when all of them are in use."""
+        
+        replicas: List[str] = []
+        """
+        DSNs of read-only replicas, e.g. ``'host=replica1 port=5432'``.
+        User, password and database name that are not given in a DSN are the same as above.
+        """
+        pin_reads_after_write: float = 0
+        """For how many seconds after a write all reads should go to the primary database instead of replicas."""
+    
+    class search:
+        keys: List[str] = ['title', 'body']
+        """Keys of :data:`Post.data` whose values are indexed for full-text search, the most important first."""
+        language: str = 'simple'
+        """PostgreSQL text search configuration, e.g. ``'english'``."""
+    
+    class verifying:
+        workers: int = 0
+        """Number of processes that check RSA signatures. With zero, signatures are checked in the calling process."""
+        chunksize: int = 16
+        """Number of signatures sent to a worker process at once."""
 
 
 class AndreasApp(Flask):
@@ -1,20 +1,33 @@
-from typing import List, Type
+import gzip
+import sys
+from itertools import chain
+from typing import BinaryIO, List, Sequence, Tuple, Type
+
+from peewee import IntegrityError
 
 from andreas.db.database import db
 from andreas.db.model import Model
-from andreas.models.event import Event
+from andreas.functions.queue import process_queue
+from andreas.functions.replay import replay
+from andreas.functions.snapshots import take_snapshots
+from andreas.models.event import Event, EventSource
 from andreas.models.keypair import KeyPair
 from andreas.models.post import Post
 from andreas.models.relations import PostPostRelation, UserPostRelation
+from andreas.models.replay import ReplayCheckpoint
 from andreas.models.server import Server
 from andreas.models.signature import Signature, UnverifiedSignature
+from andreas.models.snapshot import PostSnapshot
 from andreas.models.user import User
 
 models: List[Type[Model]] = [
     Event,
+    EventSource,
     KeyPair,
     Post,
     PostPostRelation,
+    PostSnapshot,
+    ReplayCheckpoint,
     Server,
     Signature,
     UnverifiedSignature,
@@ -53,4 +66,325 @@ def dropdb():
 @db.atomic()
 def resetdb():
     dropdb()
-    populatedb()
\ No newline at end of file
+    populatedb()
+
+def fingerprintkeys(batch_size: int = 1000):
+    """
+    Fills :data:`KeyPair.fingerprint` for keypairs that were saved before this field existed.
+    Every batch is updated with a single statement and committed on its own.
+    
+    Fingerprints are unique, so keypairs with a public key that is already stored need special care.
+    If the other keypair belongs to the same user, the newer one is merged into the older one.
+    If it belongs to another user, the newer keypair is left without fingerprint and reported.
+    """
+    batch_size = int(batch_size)
+    last_id = 0
+    while True:
+        with db.atomic():
+            keypairs = list(KeyPair.select()
+                .where(KeyPair.fingerprint.is_null(), KeyPair.id > last_id)
+                .order_by(KeyPair.id)
+                .limit(batch_size))
+            if not keypairs:
+                break
+            
+            fingerprints = {keypair.id: KeyPair.compute_fingerprint(keypair.pubkey) for keypair in keypairs}
+            known = {keypair.fingerprint: keypair
+                for keypair in KeyPair.select().where(KeyPair.fingerprint << set(fingerprints.values()))}
+            
+            values: List[Tuple[int,str]] = []
+            for keypair in keypairs:
+                fingerprint = fingerprints[keypair.id]
+                original = known.get(fingerprint)
+                if original is None:
+                    known[fingerprint] = keypair
+                    values.append((keypair.id, fingerprint))
+                elif original.user_id == keypair.user_id:
+                    _merge_keypair(keypair, original)
+                else:
+                    print(f'Keypair {keypair.id} of user {keypair.user_id} has the same public key '
+                        f'as keypair {original.id} of user {original.user_id}, leaving it without fingerprint',
+                        file=sys.stderr)
+            
+            if values:
+                db.execute_sql(
+                    f'update {KeyPair.table()} keypair set fingerprint = batch.fingerprint '
+                    f'from (values {", ".join(["(%s, %s)"] * len(values))}) as batch (id, fingerprint) '
+                    f'where keypair.id = batch.id',
+                    list(chain.from_iterable(values)))
+            last_id = keypairs[-1].id
+
+def _merge_keypair(duplicate: KeyPair, original: KeyPair):
+    """Moves the signatures of `duplicate` to `original`, which has the same public key, and deletes `duplicate`."""
+    if original.d is None and duplicate.d is not None:
+        KeyPair.update(d=duplicate.d, p=duplicate.p, q=duplicate.q).where(KeyPair.id == original.id).execute()
+        original.d, original.p, original.q = duplicate.d, duplicate.p, duplicate.q
+    Signature.update(keypair=original.id).where(Signature.keypair == duplicate.id).execute()
+    KeyPair.delete().where(KeyPair.id == duplicate.id).execute()
+
+def hashevents(batch_size: int = 1000):
+    """
+    Fills :data:`Event.content_hash` for events that were saved without it,
+    i.e. before this field existed or by bulk inserts.
+    
+    If an event turns out to be a duplicate of an earlier one, its hash is left empty,
+    and its server is recorded as an :class:`EventSource` of the earlier event.
+    The duplicate is marked as ``done`` unless it was already processed, and its :data:`Event.error` points
+    to the earlier event, so that it is neither applied by the queue nor checked again by the next run.
+    """
+    batch_size = int(batch_size)
+    last_id = 0
+    while True:
+        with db.atomic():
+            events = list(Event.select()
+                .where(
+                    Event.content_hash.is_null(),
+                    Event.error.is_null() | ~Event.error.contains('duplicate_of'),
+                    Event.id > last_id)
+                .order_by(Event.id)
+                .limit(batch_size))
+            if not events:
+                break
+            
+            for event in events:
+                content_hash = event.compute_content_hash()
+                try:
+                    with db.atomic():
+                        Event.update(content_hash=content_hash).where(Event.id == event.id).execute()
+                except IntegrityError:
+                    original = Event.get(Event.content_hash == content_hash)
+                    if event.received_from_id is not None and event.received_from_id != original.received_from_id:
+                        (EventSource
+                            .insert(event=original, server=event.received_from_id, received=event.received)
+                            .on_conflict_ignore()
+                            .execute())
+                    status = Event.DONE if event.status in (Event.PENDING, Event.RETRY) else event.status
+                    (Event
+                        .update(status=status, error={
+                            'message': f'Duplicate of event {original.id}',
+                            'duplicate_of': original.id,
+                        })
+                        .where(Event.id == event.id, Event.status == event.status)
+                        .execute())
+            last_id = events[-1].id
+
+@db.atomic()
+def deduperelations():
+    """
+    Removes duplicate relations that were saved before relations became unique, and creates the unique indexes.
+    Of all equal relations, the oldest one is kept.
+    """
+    for model in PostPostRelation, UserPostRelation:
+        db.execute_sql(
+            f'delete from {model.table()} r using {model.table()} d '
+            f'where r.source_id = d.source_id and r.type = d.type and r.target_id = d.target_id and r.id > d.id')
+        model._schema.create_indexes(safe=True)
+
+@db.atomic()
+def dedupeusers():
+    """
+    Merges duplicate servers and users that were saved before their names became unique, and creates the unique indexes.
+    Run it if ``updatedb`` fails on these indexes, and run ``repaircounters`` afterwards.
+    
+    Of all servers with the same name, and of all users with the same name on the same server, the oldest one is kept,
+    and everything that referred to the others is moved to it. Posts that end up with the same server and path
+    are merged the same way, with the data of the newer posts applied on top of the oldest one.
+    """
+    _create_mapping('server_map', f'select id, min(id) over (partition by name) keep_id from {Server.table()}')
+    _create_mapping('user_map', f'''
+        select u.id, min(u.id) over (partition by coalesce(m.keep_id, u.server_id), u.name) keep_id
+        from {User.table()} u left join server_map m on m.id = u.server_id
+    ''')
+    _create_mapping('post_map', f'''
+        select p.id, min(p.id) over (partition by coalesce(m.keep_id, p.server_id), p.path) keep_id
+        from {Post.table()} p left join server_map m on m.id = p.server_id
+    ''')
+    
+    for post_id, keep_id in db.execute_sql('select id, keep_id from post_map order by id').fetchall():
+        db.execute_sql(
+            f'update {Post.table()} post set data = post.data || duplicate.data from {Post.table()} duplicate '
+            f'where post.id = %s and duplicate.id = %s',
+            (keep_id, post_id))
+    _move_references(PostPostRelation, 'source_id', 'post_map', unique_with=('type', 'target_id'))
+    _move_references(PostPostRelation, 'target_id', 'post_map', unique_with=('source_id', 'type'))
+    _move_references(UserPostRelation, 'target_id', 'post_map', unique_with=('source_id', 'type'))
+    _move_references(Signature, 'post_id', 'post_map')
+    _move_references(UnverifiedSignature, 'post_id', 'post_map')
+    db.execute_sql(f'delete from {Post.table()} where id in (select id from post_map)')
+    
+    _move_references(KeyPair, 'user_id', 'user_map')
+    _move_references(UserPostRelation, 'source_id', 'user_map', unique_with=('type', 'target_id'))
+    db.execute_sql(f'delete from {User.table()} where id in (select id from user_map)')
+    
+    _move_references(User, 'server_id', 'server_map')
+    _move_references(Post, 'server_id', 'server_map')
+    _move_references(Event, 'received_from_id', 'server_map')
+    if EventSource.table_exists():
+        _move_references(EventSource, 'server_id', 'server_map', unique_with=('event_id',))
+    db.execute_sql(f'delete from {Server.table()} where id in (select id from server_map)')
+    
+    for model in Server, User:
+        model._schema.create_indexes(safe=True)
+
+def _create_mapping(name: str, query: str):
+    """
+    Creates a temporary table `name` that maps the ``id`` of every duplicate row to the ``keep_id`` of the row
+    it is merged into. The `query` returns both columns for all rows, and the rows that are kept are left out.
+    """
+    db.execute_sql(
+        f'create temporary table {name} on commit drop as '
+        f'select id, keep_id from ({query}) d where id <> keep_id')
+
+def _move_references(model: Type[Model], column: str, mapping: str, *, unique_with: Sequence[str] = ()):
+    """
+    Points `column` of all rows of `model` at the kept rows instead of the duplicates listed in the `mapping` table.
+    If the column is unique together with the columns `unique_with`, the rows that would become equal
+    to other rows are deleted instead.
+    """
+    if unique_with:
+        equal = ' and '.join(f'other.{other_column} = r.{other_column}' for other_column in unique_with)
+        db.execute_sql(f'''
+            delete from {model.table()} r using {mapping} m
+            where r.{column} = m.id and exists (
+                select 1 from {model.table()} other
+                left join {mapping} other_m on other_m.id = other.{column}
+                where coalesce(other_m.keep_id, other.{column}) = m.keep_id and {equal}
+                    and (other_m.id is null or other.id < r.id))
+        ''')
+    db.execute_sql(f'update {model.table()} r set {column} = m.keep_id from {mapping} m where r.{column} = m.id')
+
+@db.atomic()
+def repaircounters():
+    """
+    Recomputes :data:`Post.comment_count`, :data:`Post.last_activity` and :data:`Post.author_ids` of all posts
+    from the relations. They are normally maintained by triggers, so this is only needed for posts that existed
+    before these fields did, or if the triggers were disabled for a while.
+    """
+    db.execute_sql(f'''
+        update {Post.table()} post set
+            comment_count = (
+                select count(*) from {PostPostRelation.table()} r where r.target_id = post.id and r.type = 'comments'),
+            last_activity = greatest(post.created, (
+                select max(r.created) from {PostPostRelation.table()} r
+                where r.target_id = post.id and r.type = 'comments')),
+            author_ids = array(
+                select r.source_id from {UserPostRelation.table()} r where r.target_id = post.id and r.type = 'wrote'
+                order by r.id)
+    ''')
+
+def reindexsearch(batch_size: int = 1000):
+    """
+    Recomputes :data:`Post.search_vector` of all posts, e.g. after ``app.config.search`` was changed.
+    Every batch of posts is updated in its own transaction, so the command can run while the server is working.
+    """
+    batch_size = int(batch_size)
+    last_id = 0
+    while True:
+        with db.atomic():
+            cursor = db.execute_sql(
+                f'update {Post.table()} post set search_vector = {Post.search_vector_sql("post")} '
+                f'where id in (select id from {Post.table()} where id > %s order by id limit %s) '
+                f'returning id',
+                (last_id, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            break
+        last_id = max(ids)
+
+# Rows are written and read by COPY in CSV format with quote and delimiter characters that never occur in JSON text,
+# so every row is exactly one JSON document and nothing in it is escaped
+_COPY_NDJSON = "(format csv, quote e'\\x01', delimiter e'\\x02')"
+
+def _open_ndjson(path: str, mode: str) -> BinaryIO:
+    if path == '-':
+        return sys.stdout.buffer if mode == 'wb' else sys.stdin.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+@db.atomic()
+def exportevents(path: str = '-'):
+    """
+    Writes all events to file `path` (standard output by default), one JSON object per line, oldest first.
+    The file is compressed with gzip if its name ends with ``.gz``.
+    
+    Only the content of the events is exported, not their processing state.
+    :data:`Event.received_from` is exported as the server's name.
+    """
+    with _open_ndjson(path, 'wb') as file:
+        db.cursor().copy_expert(
+            f'''
+            copy (
+                select json_build_object(
+                    'received', e.received, 'received_from', s.name, 'server', e.server, 'authors', e.authors,
+                    'parent', e.parent, 'path', e.path, 'diff', e.diff, 'signatures', e.signatures)
+                from {Event.table()} e
+                left join {Server.table()} s on s.id = e.received_from_id
+                order by e.id
+            ) to stdout {_COPY_NDJSON}
+            ''',
+            file)
+
+def importevents(path: str = '-', process: int = 0, batch_size: int = 1000):
+    """
+    Reads events written by :func:`exportevents()` from file `path` (standard input by default)
+    and adds them to the ingestion queue with :meth:`Event.receive_many()`, oldest first.
+    Events that are already known are only recorded as received from one more server.
+    
+    The file is streamed into a temporary table and read back in batches of `batch_size`,
+    so the memory use doesn't depend on its size.
+    If `process` is non-zero, processes the whole queue afterwards, otherwise leaves it to the workers.
+    """
+    batch_size = int(batch_size)
+    with db.atomic():
+        db.execute_sql('create temporary table event_import (doc jsonb) on commit drop')
+        with _open_ndjson(path, 'rb') as file:
+            db.cursor().copy_expert(f'copy event_import (doc) from stdin {_COPY_NDJSON}', file)
+        
+        # A named cursor keeps the result on the server and only sends the rows that are fetched
+        cursor = db.connection().cursor('event_import')
+        cursor.execute('''
+            select
+                (doc->>'received')::timestamp,
+                doc->>'received_from',
+                doc->>'server',
+                array(select jsonb_array_elements_text(doc->'authors')),
+                doc->>'parent',
+                doc->>'path',
+                doc->'diff',
+                doc->'signatures'
+            from event_import
+            order by (doc->>'received')::timestamp
+        ''')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            
+            servers = Server.from_names(row[1] for row in rows if row[1] is not None)
+            Event.receive_many(
+                Event(received=received, received_from=servers.get(received_from), server=server, authors=authors,
+                    parent=parent, path=path, diff=diff, signatures=signatures)
+                for received, received_from, server, authors, parent, path, diff, signatures in rows)
+        cursor.close()
+    
+    if int(process):
+        while process_queue():
+            pass
+
+def replayevents(workers: int = 4, resume: int = 0, from_snapshots: int = 1):
+    """
+    Rebuilds all posts, relations and signatures from the event log with `workers` processes.
+    If `resume` is non-zero, continues an interrupted replay instead of starting over.
+    If `from_snapshots` is zero, ignores the snapshots and replays the whole log.
+    See :mod:`andreas.functions.replay`.
+    """
+    replay(int(workers), resume=bool(int(resume)), from_snapshots=bool(int(from_snapshots)))
+
+@db.atomic()
+def snapshotposts(min_events: int = 100):
+    """
+    Takes snapshots of the posts that got at least `min_events` new events since their last snapshot.
+    Should be run periodically, see :mod:`andreas.functions.snapshots`.
+    """
+    take_snapshots(int(min_events))
\ No newline at end of file
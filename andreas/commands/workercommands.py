@@ -0,0 +1,23 @@
+from time import sleep
+
+from andreas.db.invalidation import start_listener
+from andreas.functions.queue import process_queue, requeue_events
+
+def worker(batch_size: int = 100, poll_interval: float = 1.0):
+    """
+    Processes events from the ingestion queue until interrupted.
+    When the queue is empty, checks it again every `poll_interval` seconds.
+    """
+    batch_size = int(batch_size)
+    poll_interval = float(poll_interval)
+    
+    start_listener()
+    while True:
+        if not process_queue(batch_size):
+            sleep(poll_interval)
+
+def requeue(status: str = 'failed'):
+    """
+    Makes the events with given status pending again, so that the workers process them once more.
+    """
+    print(f'{requeue_events(status)} events requeued')
@@ -1,16 +1,56 @@
-from typing import List
+import random
+import time
+from typing import Dict, List
 
 import peewee
+from peewee import SENTINEL
+from playhouse.pool import PooledPostgresqlExtDatabase
 from playhouse.postgres_ext import PostgresqlExtDatabase
+from psycopg2.extensions import parse_dsn
 
 from andreas.app import app
 
 
-class Database(PostgresqlExtDatabase):
+class _DatabaseMixin:
+    _replica_class = PostgresqlExtDatabase
+    
     def __init__(self, **kwargs):
         kwargs['register_hstore'] = False
         super().__init__(app.config.db.database, host=app.config.db.host, port=app.config.db.port,
             user=app.config.db.user, password=app.config.db.password, **kwargs)
+        
+        self.replicas: List[PostgresqlExtDatabase] = [self._make_replica(dsn, **kwargs) for dsn in app.config.db.replicas]
+        """Read-only databases that :meth:`for_reading()` may choose from."""
+        
+        self._last_write: float = float('-inf')
+    
+    def _make_replica(self, dsn: str, **kwargs) -> PostgresqlExtDatabase:
+        # Anything that is not in the DSN is the same as on the primary
+        params = {'dbname': app.config.db.database, 'user': app.config.db.user, 'password': app.config.db.password}
+        params.update(parse_dsn(dsn))
+        database = params.pop('dbname')
+        return self._replica_class(database, **{**params, **kwargs})
+    
+    def for_reading(self) -> PostgresqlExtDatabase:
+        """
+        Returns a database for running a read-only query: one of the :data:`replicas`, chosen at random.
+        
+        The primary database itself is returned if there are no replicas, inside a transaction
+        (so that the query sees the transaction's own changes),
+        and for ``app.config.db.pin_reads_after_write`` seconds after anything was written in this process
+        (so that the query sees the changes even if the replicas lag behind).
+        """
+        if (not self.replicas
+            or self.in_transaction()
+            or time.monotonic() - self._last_write < app.config.db.pin_reads_after_write
+        ):
+            return self
+        return random.choice(self.replicas)
+    
+    def execute_sql(self, sql, params=None, commit=SENTINEL):
+        if not sql.lstrip()[:6].lower().startswith('select'):
+            self._last_write = time.monotonic()
+        return super().execute_sql(sql, params, commit)
     
     def create_tables(self, models: List[peewee.Model], **options):
         for schema in set(m._meta.schema for m in models):
@@ -18,4 +58,46 @@ class Database(PostgresqlExtDatabase):
         super().create_tables(models, **options)
 
 
-db = Database()
\ No newline at end of file
+class Database(_DatabaseMixin, PostgresqlExtDatabase):
+    """Opens a new connection for every thread that uses the database."""
+
+
+class PooledDatabase(_DatabaseMixin, PooledPostgresqlExtDatabase):
+    """
+    Keeps a pool of connections, configured by ``max_connections``, ``stale_timeout`` and ``timeout``
+    in ``app.config.db``. Closing a connection returns it to the pool.
+    """
+    _replica_class = PooledPostgresqlExtDatabase
+    
+    def __init__(self, **kwargs):
+        super().__init__(
+            max_connections=app.config.db.max_connections,
+            stale_timeout=app.config.db.stale_timeout,
+            timeout=app.config.db.timeout,
+            **kwargs)
+    
+    def stats(self) -> Dict[str,int]:
+        """Returns the numbers of connections in the pool, for monitoring."""
+        in_use = len(self._in_use)
+        idle = len(self._connections)
+        return {
+            'max_connections': self._max_connections,
+            'in_use': in_use,
+            'idle': idle,
+            'total': in_use + idle,
+        }
+
+
+db = PooledDatabase() if app.config.db.pool else Database()
+
+
+@app.before_request
+def open_connection():
+    db.connect(reuse_if_open=True)
+
+
+@app.teardown_request
+def close_connection(exception):
+    for database in [db, *db.replicas]:
+        if not database.is_closed():
+            database.close()
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Keeps in-process caches consistent between processes.
+
+Models that are cached somewhere send a notification to :data:`CHANNEL` from their triggers
+(see :func:`notify_sql()`) whenever their rows change.
+Each process runs an :class:`InvalidationListener` that receives these notifications
+and passes them to the handlers registered with :func:`on_invalidation()`.
+"""
+import json
+import logging
+import select
+from collections import defaultdict
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from andreas.db.database import db
+
+CHANNEL = 'andreas_invalidation'
+
+logger = logging.getLogger(__name__)
+
+InvalidationHandler = Callable[[Optional[Dict]], None]
+"""
+Receives the payload of a notification, or ``None`` if some notifications could have been missed
+and therefore all the cached data must be dropped.
+"""
+
+_handlers: Dict[str,List[InvalidationHandler]] = defaultdict(list)
+
+
+def notify_sql(table: str, payload: str) -> str:
+    """
+    Returns PL/pgSQL code that sends a notification about a change in `table`.
+    
+    :param table: Table name that will be used to choose the handlers.
+    :param payload: SQL expression for a JSON object with details of the change,
+        e.g. ``json_build_object('id', new.id)``.
+    """
+    return f"perform pg_notify('{CHANNEL}', (jsonb_build_object('table', '{table}') || ({payload})::jsonb)::text)"
+
+
+def on_invalidation(table: str) -> Callable[[InvalidationHandler], InvalidationHandler]:
+    """
+    Decorator that registers a handler for notifications about changes in `table`.
+    """
+    def decorator(handler: InvalidationHandler) -> InvalidationHandler:
+        _handlers[table].append(handler)
+        return handler
+    return decorator
+
+
+def dispatch(payload: Optional[Dict]):
+    """
+    Passes the notification payload to all the handlers registered for its table.
+    With ``None``, calls all the handlers for all tables.
+    
+    A failing handler is logged and doesn't prevent the other handlers from running.
+    """
+    if payload is None:
+        handlers = [handler for table_handlers in list(_handlers.values()) for handler in table_handlers]
+    else:
+        handlers = list(_handlers.get(payload['table'], []))
+    
+    for handler in handlers:
+        try:
+            handler(payload)
+        except Exception:
+            logger.exception(f'Invalidation handler {handler.__qualname__} failed for {payload}')
+
+
+class InvalidationListener(Thread):
+    """
+    Background thread that listens to :data:`CHANNEL` on its own connection and dispatches the notifications.
+    If the connection is lost, it reconnects and invalidates everything, since some notifications could be lost.
+    """
+    def __init__(self, poll_interval: float = 5.0, reconnect_interval: float = 5.0):
+        super().__init__(name='InvalidationListener', daemon=True)
+        self.poll_interval: float = poll_interval
+        self.reconnect_interval: float = reconnect_interval
+        self._stopped = Event()
+    
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except psycopg2.Error:
+                pass
+            except Exception:
+                # The listener must keep running, or the caches would never be invalidated again
+                logger.exception('Invalidation listener failed')
+            dispatch(None)
+            self._stopped.wait(self.reconnect_interval)
+    
+    def _listen(self):
+        connection = psycopg2.connect(database=db.database, **db.connect_params)
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f'listen {CHANNEL}')
+            
+            while not self._stopped.is_set():
+                if select.select([connection], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    dispatch(json.loads(notification.payload))
+        finally:
+            connection.close()
+    
+    def stop(self):
+        self._stopped.set()
+
+
+_listener: Optional[InvalidationListener] = None
+_listener_lock = Lock()
+
+
+def start_listener() -> InvalidationListener:
+    """
+    Starts the listener for the current process, unless it is already running.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = InvalidationListener()
+            _listener.start()
+        return _listener
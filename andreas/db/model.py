@@ -1,11 +1,13 @@
+from collections import OrderedDict
+from threading import local
 from typing import Dict, List, Optional, Tuple, Type
 
-from playhouse import signals
+import peewee
 
 from andreas.db.database import db
 
 
-class Model(signals.Model):
+class Model(peewee.Model):
     class Meta:
         database = db
         schema = 'andreas'
@@ -23,12 +25,28 @@ class Model(signals.Model):
     def triggers(cls) -> Optional[Dict[str,str]]:
         return None
     
+    @classmethod
+    def obsolete_indexes(cls) -> List[str]:
+        """
+        Returns the names of indexes that older versions created on the table and that are not needed anymore.
+        They are dropped by :meth:`create_table()`.
+        """
+        return []
+    
     @classmethod
     def create_table(cls, fail_silently=False):
         """
         Creates a table for given model and creates/recreates all the triggers on it.
+        If the table already exists, adds the columns and indexes that are missing in it
+        and drops the :meth:`obsolete indexes<obsolete_indexes>`.
         """
-        super().create_table(fail_silently=fail_silently)
+        if cls.table_exists():
+            cls.add_missing_columns()
+            for index_name in cls.obsolete_indexes():
+                db.execute_sql(f'drop index if exists {cls._meta.schema}.{index_name}')
+            cls._schema.create_indexes(safe=True)
+        else:
+            super().create_table(fail_silently=fail_silently)
         
         if cls.triggers():
             # Remove the old triggers
@@ -48,6 +66,20 @@ class Model(signals.Model):
                     f'create trigger {trigger_name} {when} on {cls.table()} '
                     f'for each row execute procedure {cls.table()}_{trigger_name}()')
     
+    @classmethod
+    def add_missing_columns(cls):
+        """
+        Adds columns for the fields that were introduced to the model after its table had been created.
+        Values in such columns will be NULL for all existing rows, so the new fields should be nullable.
+        """
+        existing_columns = set(column.name for column in db.get_columns(cls._meta.table_name, cls._meta.schema))
+        for field in cls._meta.sorted_fields:
+            if field.column_name not in existing_columns:
+                ctx = cls._schema._create_context()
+                ctx.sql(field.ddl(ctx))
+                sql, params = ctx.query()
+                db.execute_sql(f'alter table {cls.table()} add column {sql}', params)
+    
     def reload(self):
         """
         Updates all the fields from the database.
@@ -58,29 +90,125 @@ class Model(signals.Model):
             setattr(self, field_name, val)
         self._dirty.clear()
     
+    def save(self, *args, **kwargs):
+        """
+        Saves the model. After that, all other models that waited for it will be automatically saved, too.
+        """
+        result = super().save(*args, **kwargs)
+        
+        if self._models_to_save_after_myself:
+            models, self._models_to_save_after_myself = self._models_to_save_after_myself, []
+            for model, model_kwargs in models:
+                model.save(**model_kwargs)
+        
+        return result
+    
     def save_after(self, dependency: 'Model', **kwargs) -> None:
         """
         Registers handler that will automatically save this model right as soon as `dependency` will be saved.
         This handler works only once and unregisters itself after finishing its work.
+        
+        Inside a :class:`UnitOfWork`, the model is instead saved by :meth:`UnitOfWork.flush()`.
         """
-        dependency._models_to_save_after_myself.append((self, kwargs))
+        unit_of_work = UnitOfWork.current()
+        if unit_of_work:
+            unit_of_work.add(self, dependency, kwargs)
+        else:
+            dependency._models_to_save_after_myself.append((self, kwargs))
     
     @classmethod
     def create_after(cls, dependency: 'Model', **kwargs) -> 'Model':
         """
         Creates instance and registers handler that will automatically save it as soon as `dependency` will be saved.
         This handler works only once and unregisters itself after finishing its work.
+        
+        Inside a :class:`UnitOfWork`, the instance is instead created by :meth:`UnitOfWork.flush()`.
         """
         instance = cls(**kwargs)
-        dependency._models_to_save_after_myself.append((instance, {}))
+        instance.save_after(dependency)
         return instance
 
 
-@signals.post_save()
-def post_save(model_class: Type[Model], instance: Model, created: bool):
+class UnitOfWork:
     """
-    After an object is saved, all other models that waited for it will be automatically saved, too.
+    Context that collects models registered with :meth:`Model.save_after()` and :meth:`Model.create_after()`
+    and saves them in bulk instead of one by one.
+    
+    Pending creates are grouped by model class and inserted with a single ``insert_many`` per class
+    as soon as their dependencies have primary keys. This happens in :meth:`flush()`,
+    which is called automatically when the context is exited without an exception.
     """
-    for model, kwargs in instance._models_to_save_after_myself:
-        model.save(**kwargs)
-    instance._models_to_save_after_myself = []
\ No newline at end of file
+    _local = local()
+    
+    def __init__(self):
+        self._pending: List[Tuple[Model,Model,Dict]] = []
+    
+    @classmethod
+    def current(cls) -> Optional['UnitOfWork']:
+        """Returns the innermost unit of work that is active in the current thread, if any."""
+        stack = getattr(cls._local, 'stack', None)
+        return stack[-1] if stack else None
+    
+    def __enter__(self) -> 'UnitOfWork':
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        self._local.stack.append(self)
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._local.stack.pop()
+        if exc_type is None:
+            self.flush()
+    
+    def add(self, instance: Model, dependency: Model, kwargs: Dict) -> None:
+        self._pending.append((instance, dependency, kwargs))
+    
+    def flush(self) -> None:
+        """
+        Saves all pending models whose dependencies are saved, then the models that depended on those, and so on.
+        Models whose dependencies are still not saved stay pending.
+        """
+        while True:
+            ready = [item for item in self._pending if item[1]._pk is not None]
+            if not ready:
+                break
+            self._pending = [item for item in self._pending if item[1]._pk is None]
+            
+            # New instances without custom save options can be inserted in bulk, the rest are saved one by one
+            creates: Dict[Type[Model],List[Model]] = OrderedDict()
+            for instance, _, kwargs in ready:
+                if instance._pk is None and not kwargs:
+                    creates.setdefault(type(instance), []).append(instance)
+                else:
+                    instance.save(**kwargs)
+            
+            for model_class, instances in creates.items():
+                self._insert_many(model_class, instances)
+    
+    def _insert_many(self, model_class: Type[Model], instances: List[Model]) -> None:
+        primary_key = model_class._meta.primary_key
+        fields = [field for field in model_class._meta.sorted_fields if field is not primary_key]
+        
+        rows = []
+        for instance in instances:
+            row = {}
+            for field in fields:
+                if field.name in instance.__rel__ and instance.__data__.get(field.name) is None:
+                    # Foreign key to an object that had no primary key yet when it was assigned
+                    value = instance.__rel__[field.name]._pk
+                elif field.name in instance.__data__:
+                    value = instance.__data__[field.name]
+                else:
+                    value = field.default() if callable(field.default) else field.default
+                row[field.name] = value
+            rows.append(row)
+        
+        cursor = model_class.insert_many(rows).returning(primary_key).tuples().execute()
+        for instance, (pk,) in zip(instances, cursor):
+            instance._pk = pk
+            instance._dirty.clear()
+            
+            # Models that were registered to wait for this one before the unit of work began
+            for model, kwargs in instance._models_to_save_after_myself:
+                self.add(model, instance, kwargs)
+            instance._models_to_save_after_myself = []
\ No newline at end of file
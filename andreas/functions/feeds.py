@@ -0,0 +1,83 @@
+"""
+Timelines of posts, newest first.
+
+Pages are selected by keyset: instead of an offset, every page starts right after the :data:`FeedPage.cursor`
+of the previous one, so deep pages are as fast as the first one.
+Every page costs a fixed number of queries: one for the posts and their servers, and one for their authors
+(see :meth:`Post.prefetch_authors()<andreas.models.post.Post.prefetch_authors>`).
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from peewee import ModelSelect, Tuple as SqlTuple
+
+from andreas.db.database import db
+from andreas.models.post import Post
+from andreas.models.relations import UserPostRelation
+from andreas.models.server import Server
+from andreas.models.user import User
+
+FeedCursor = Tuple[datetime,int]
+"""The :data:`Post.modified` and :data:`Post.id` of the last post of a page."""
+
+
+class FeedPage(NamedTuple):
+    posts: List[Post]
+    """The posts, with their servers and authors already loaded."""
+    cursor: Optional[FeedCursor]
+    """Pass it as `after` to get the next page. ``None`` if this page is the last one."""
+
+
+def global_feed(*, limit: int = 50, after: Optional[FeedCursor] = None) -> FeedPage:
+    """Returns the most recently modified posts of all servers."""
+    return _page(_posts(), limit, after)
+
+
+def server_feed(server: Union[Server,int], *, limit: int = 50, after: Optional[FeedCursor] = None) -> FeedPage:
+    """Returns the most recently modified posts published on `server`."""
+    return _page(_posts().where(Post.server == server), limit, after)
+
+
+def author_feed(user: Union[User,int], *, limit: int = 50, after: Optional[FeedCursor] = None) -> FeedPage:
+    """Returns the most recently modified posts written by `user`."""
+    query = (_posts()
+        .join(UserPostRelation, on=(UserPostRelation.target == Post.id))
+        .where(UserPostRelation.source == user, UserPostRelation.type == 'wrote'))
+    return _page(query, limit, after)
+
+
+def find_posts(*, contains: Optional[Dict[str,Any]] = None, has_keys: Iterable[str] = (), limit: int = 50,
+    after: Optional[FeedCursor] = None
+) -> FeedPage:
+    """
+    Returns the most recently modified posts whose :data:`Post.data` matches all given filters.
+    
+    :param contains: JSON object that must be contained in the data (``@>``).
+        For example, ``{'tags': ['Aaa']}`` matches all posts that have ``'Aaa'`` among their tags.
+        This filter is answered by the GIN index on :data:`Post.data`.
+    :param has_keys: Top-level keys that must all be present in the data (``?&``).
+        The ``jsonb_path_ops`` index can't answer this filter, so on big tables combine it with `contains`.
+    """
+    query = _posts()
+    if contains:
+        query = query.where(Post.data.contains(contains))
+    has_keys = list(has_keys)
+    if has_keys:
+        query = query.where(Post.data.contains_all(*has_keys))
+    return _page(query, limit, after)
+
+
+def _posts() -> ModelSelect:
+    return Post.select(Post, Server).join(Server).switch(Post)
+
+
+def _page(query: ModelSelect, limit: int, after: Optional[FeedCursor]) -> FeedPage:
+    if after is not None:
+        query = query.where(SqlTuple(Post.modified, Post.id) < SqlTuple(*after))
+    
+    # Load one extra post to find out whether there is a next page
+    posts = list(query.order_by(Post.modified.desc(), Post.id.desc()).limit(limit + 1).bind(db.for_reading()))
+    cursor = (posts[limit - 1].modified, posts[limit - 1].id) if len(posts) > limit else None
+    posts = posts[:limit]
+    
+    return FeedPage(Post.prefetch_authors(posts), cursor)
\ No newline at end of file
@@ -1,90 +1,333 @@
 from itertools import chain
-from typing import Dict, List, Set
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
-import rsa
+from peewee import DoesNotExist, Tuple as SqlTuple
 
-from andreas.functions.querying import get_post_by_identifier
-from andreas.functions.verifying import verify_post
+from andreas.db.database import db
+from andreas.functions.querying import split_identifier
+from andreas.functions.resolving import Resolver
+from andreas.functions.verifying import VerificationJob, _serialize, verification_executor
 from andreas.models.event import Event
+from andreas.models.keypair import public_key_cache
 from andreas.models.post import Post
 from andreas.models.relations import PostPostRelation, UserPostRelation
-from andreas.models.server import Server
 from andreas.models.signature import Signature, UnverifiedSignature
 from andreas.models.user import User
 
+POST_LOCK_NAMESPACE = 1
+"""The first key of all advisory locks taken by :func:`lock_posts()`. Other kinds of locks should use other keys."""
 
-def process_event(event: Event):
-    # Users whose approvals we need for this post
-    required_users: Set[User] = set()
+def process_event(event: Event, **kwargs):
+    """
+    Applies a single event. Raises :class:`UnauthorizedAction` if the event could not be authorized,
+    or :class:`MissingReference` if it refers to an unknown server, user or parent post.
     
-    # Create or update the post with data provided in this event
-    if event.path:
-        server: Server = Server.get(Server.name == event.server)
-        try:
-            post = Post.get(Post.server == server, Post.path == event.path)
-        except Post.DoesNotExist:
-            post = Post(server=server, path=event.path)
-        
-        # Add/replace elements from the event,
-        # remove elements which are nulls in the information provided by event
-        for key, value in event.diff.items():
-            if value is not None:
-                post.data[key] = value
-            elif key in post.data:
-                del post.data[key]
-        
-        # Save relations
-        for user_string in event.authors:
-            user = User.from_string(user_string)
-            UserPostRelation.create_after(post, source=user, type='wrote', target=post)
-            required_users.add(user)
-        if event.parent:
-            parent = get_post_by_identifier(event.parent)
-            PostPostRelation.create_after(post, source=post, type='comments', target=parent)
-        
-        verified_signatures: List[Dict] = []
-        unverified_signatures: List[Dict] = []
-        verified_users: Set[User] = set()
-        unverified_usernames: Set[str] = set()
+    This is just a shortcut for calling :func:`process_events()` with a single event.
+    """
+    errors = process_events([event], **kwargs)
+    if event in errors:
+        raise errors[event]
+
+
+@db.atomic()
+def process_events(events: Iterable[Event], *, batch_size: int = 1000, lock_posts: bool = True,
+    order_by_received: bool = False, update_status: bool = True
+) -> Dict[Event, 'EventError']:
+    """
+    Applies all given events in one transaction, in the same order as they are given.
+    
+    Events are processed in batches of `batch_size`. For every batch, all the servers, users, posts and keypairs
+    are loaded from the database with a few queries, and all the new rows are inserted with a few more.
+    
+    Events that could not be authorized or refer to something unknown don't stop the processing.
+    Instead, the function returns a dict that maps each of them to its :class:`UnauthorizedAction`
+    or :class:`MissingReference`, and all other events are still applied.
+    
+    :param lock_posts: Take an advisory lock on every affected post before reading it, see :func:`lock_posts()`.
+        This allows to run many ingestions at once in different threads and processes:
+        events for the same post will wait for each other, while events for different posts won't.
+        Locks are taken for the whole batch at once, so that concurrent batches can't deadlock,
+        but they are only released at the end of the transaction.
+        To keep the risk of deadlocks low, don't process more than one batch per transaction concurrently.
+    :param order_by_received: Apply the events of each batch in the order of :data:`Event.received`
+        instead of the order they were given in.
+    :param update_status: Store the outcome of every saved event in its :data:`Event.status` and :data:`Event.error`:
+        ``done`` if it was applied, ``retry`` if it refers to something unknown and ``rejected`` otherwise.
+        Events without a path have nothing to apply, so they are ``done`` as well.
+    """
+    errors: Dict[Event, EventError] = {}
+    resolver = Resolver()
+    
+    def process_batch(batch: List[Event]):
+        batch_errors = _process_batch(batch, resolver, lock_posts, order_by_received)
+        if update_status:
+            _update_status(batch, batch_errors)
+        errors.update(batch_errors)
+    
+    batch: List[Event] = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= batch_size:
+            process_batch(batch)
+            batch = []
+    if batch:
+        process_batch(batch)
+    
+    return errors
+
+
+def _process_batch(events: List[Event], resolver: Resolver, lock: bool, order_by_received: bool
+) -> Dict[Event, 'EventError']:
+    errors: Dict[Event, EventError] = {}
+    
+    events = [event for event in events if event.path]
+    if not events:
+        return errors
+    if order_by_received:
+        events.sort(key=lambda event: (event.received, event.id))
+    
+    # Make sure nobody else modifies these posts until we are done.
+    # New comments update the counters of their parents, so the parents are locked in the same go
+    if lock:
+        lock_posts(
+            set((event.server, event.path) for event in events) |
+            set(split_identifier(event.parent) for event in events if event.parent))
+    
+    # Load everything we are going to need for the whole batch
+    servers = resolver.servers((event.server for event in events), strict=False)
+    users = resolver.users(chain.from_iterable(event.authors for event in events), strict=False)
+    
+    # Events that refer to unknown servers or users can't be applied, but they shouldn't stop the others
+    resolved_events: List[Event] = []
+    for event in events:
+        unknown_users = set(event.authors) - users.keys()
+        if event.server not in servers:
+            errors[event] = MissingReference(f'Unknown server: {event.server}')
+        elif unknown_users:
+            errors[event] = MissingReference(f'Unknown users: {", ".join(sorted(unknown_users))}')
+        else:
+            resolved_events.append(event)
+    events = resolved_events
+    if not events:
+        return errors
+    
+    parents = resolver.posts(event.parent for event in events if event.parent)
+    posts = _load_posts(set((servers[event.server].id, event.path) for event in events))
+    
+    # If a signature specifies its keypair, only that keypair is loaded and checked
+    signers = set(
+        (user_string, fingerprint)
+        for event in events
+        for user_string, (_, fingerprint) in event.parsed_signatures().items())
+    public_keys = public_key_cache.get_many(user_string for user_string, fingerprint in signers if fingerprint is None)
+    public_keys_by_fingerprint = public_key_cache.get_by_fingerprints(
+        (user_string, fingerprint) for user_string, fingerprint in signers if fingerprint is not None)
+    
+    def candidate_keys(user_string: str, fingerprint: Optional[str]) -> List[Tuple[int,int,int]]:
+        if fingerprint is None:
+            keys = public_keys[user_string]
+        else:
+            key = public_keys_by_fingerprint.get((user_string, fingerprint))
+            keys = [key] if key else []
+        return [(key.id, key.pubkey.n, key.pubkey.e) for key in keys]
+    
+    relations_user_post: List[Dict] = []
+    relations_post_post: List[Dict] = []
+    verified_signatures: List[Dict] = []
+    unverified_signatures: List[Dict] = []
+    outdated_unverified_signatures: List[Tuple[int,str]] = []
+    
+    for events_round in _split_into_rounds(events):
+        # Prepare the new state of every post in this round
+        pending: List[_PendingEvent] = []
+        for event in events_round:
+            server = servers[event.server]
+            post = posts.get((server.id, event.path)) or Post(path=event.path)
+            post.server = server
+            pending.append(_PendingEvent(event, post, set(users[user_string] for user_string in event.authors)))
         
-        # Try to verify and save as many signatures as possible
-        for user_string, signature_hex in event.signatures.items():
-            signature_data = bytes.fromhex(signature_hex)
-            try:
-                keypair = verify_post(post, user_string, signature_data, authors=event.authors)
-                verified_signatures.append(dict(event=event, data=signature_data, keypair=keypair))
-                verified_users.add(keypair.user)
-            except rsa.VerificationError:
-                unverified_signatures.append(dict(event=event, data=signature_data, user=user_string))
-                unverified_usernames.add(user_string)
+        # Verify all the signatures of this round at once, possibly in parallel
+        jobs: List[VerificationJob] = []
+        for p in pending:
+            signatures: Dict[str,bytes] = {}
+            keys: Dict[str,List[Tuple[int,int,int]]] = {}
+            for user_string, (signature_data, fingerprint) in p.signatures.items():
+                signatures[user_string] = signature_data
+                keys[user_string] = candidate_keys(user_string, fingerprint)
+            jobs.append((p.serialized, signatures, keys))
+        results = verification_executor().verify(jobs)
         
-        # If we got all approvals, then we save post and fill post_id in all the signatures
-        success = False
-        if verified_users >= required_users:
-            success = True
+        for p, matched_keypair_ids in zip(pending, results):
+            event, post = p.event, p.post
             
-            post.save()
-            for signature_data in chain(verified_signatures, unverified_signatures):
-                signature_data['post'] = post
+            # The parent may be created by an earlier event, so it can only be checked right before applying
+            if event.parent and event.parent not in parents:
+                errors[event] = MissingReference(f'Unknown post: {event.parent}', post=event.parent)
+                continue
             
-            # If we have already analyzed this event in the past
-            # but had some user's signatures unverified and now some of them became verified,
-            # delete the old unverified instances
-            (UnverifiedSignature.delete()
-                .where(UnverifiedSignature.event == event)
-                .where(UnverifiedSignature.user << [repr(u) for u in verified_users])
-                .execute())
+            event_verified_signatures: List[Dict] = []
+            event_unverified_signatures: List[Dict] = []
+            verified_usernames: Set[str] = set()
+            unverified_usernames: Set[str] = set()
+            
+            for user_string, (signature_data, _) in p.signatures.items():
+                keypair_id = matched_keypair_ids[user_string]
+                if keypair_id is not None:
+                    event_verified_signatures.append(dict(event=event, data=signature_data, keypair=keypair_id, post=None))
+                    verified_usernames.add(user_string)
+                else:
+                    event_unverified_signatures.append(dict(event=event, data=signature_data, user=user_string, post=None))
+                    unverified_usernames.add(user_string)
+            verified_signatures.extend(event_verified_signatures)
+            unverified_signatures.extend(event_unverified_signatures)
+            
+            # If we got all approvals, then we save post and fill post_id in all the signatures
+            if verified_usernames >= set(event.authors):
+                post.id = Post.merge_data(post.server, post.path, event.diff, event.id)
+                post.data = p.data
+                posts[(post.server_id, post.path)] = post
+                parents[event.server + post.path] = post
+                resolver.add_post(event.server + post.path, post)
+                
+                for signature_data in chain(event_verified_signatures, event_unverified_signatures):
+                    signature_data['post'] = post
+                
+                for user in p.required_users:
+                    relations_user_post.append(dict(source=user, type='wrote', target=post))
+                if event.parent:
+                    relations_post_post.append(dict(source=post, type='comments', target=parents[event.parent]))
+                
+                # If we have already analyzed this event in the past
+                # but had some user's signatures unverified and now some of them became verified,
+                # we will delete the old unverified instances
+                outdated_unverified_signatures.extend((event.id, user_string) for user_string in verified_usernames)
+            else:
+                verified_users = set(users[user_string] for user_string in verified_usernames if user_string in users)
+                errors[event] = UnauthorizedAction(p.required_users, verified_users, unverified_usernames)
+    
+    if outdated_unverified_signatures:
+        (UnverifiedSignature.delete()
+            .where(SqlTuple(UnverifiedSignature.event, UnverifiedSignature.user) << outdated_unverified_signatures)
+            .execute())
+    
+    # Save the relations and signatures.
+    # We need the signatures no matter what, even for the events that were rejected.
+    # Relations that already exist are silently skipped
+    if relations_user_post:
+        UserPostRelation.insert_many(relations_user_post).on_conflict_ignore().execute()
+    if relations_post_post:
+        PostPostRelation.insert_many(relations_post_post).on_conflict_ignore().execute()
+    if verified_signatures:
+        Signature.insert_many(verified_signatures).execute()
+    if unverified_signatures:
+        UnverifiedSignature.insert_many(unverified_signatures).execute()
+    
+    return errors
+
+
+def _update_status(events: List[Event], errors: Dict[Event, 'EventError']):
+    done_ids = []
+    for event in events:
+        if event.id is None:
+            continue
         
-        # Save the signatures
-        # We need them no matter what, even if we are going to raise the exception
-        if verified_signatures:
-            Signature.insert_many(verified_signatures).execute()
-        if unverified_signatures:
-            UnverifiedSignature.insert_many(unverified_signatures).execute()
+        error = errors.get(event)
+        if error is None:
+            event.status, event.error = Event.DONE, None
+            done_ids.append(event.id)
+        else:
+            # Missing servers, users or parents may still arrive, while a rejected event will stay rejected
+            event.status = Event.RETRY if isinstance(error, MissingReference) else Event.REJECTED
+            event.error = error.details()
+            Event.update(status=event.status, error=event.error).where(Event.id == event.id).execute()
+    
+    if done_ids:
+        Event.update(status=Event.DONE, error=None).where(Event.id << done_ids).execute()
+
+
+def lock_posts(keys: Iterable[Tuple[str,str]]):
+    """
+    Takes transaction-level advisory locks for the posts identified by pairs ``(server name, path)``.
+    The posts don't have to exist yet. Locks are released when the current transaction ends.
+    
+    Locks are always taken in the same order, so two transactions that lock overlapping sets of posts
+    with a single call each never deadlock.
+    """
+    identifiers = sorted(set(server + '/' + path for server, path in keys))
+    if identifiers:
+        db.execute_sql(
+            'select pg_advisory_xact_lock(%s, k) '
+            'from (select distinct hashtext(identifier) k from unnest(%s::text[]) identifier order by k) s',
+            (POST_LOCK_NAMESPACE, identifiers))
+
+
+def _split_into_rounds(events: List[Event]) -> Iterable[List[Event]]:
+    """
+    Splits events into consecutive groups in which every post is affected at most once.
+    
+    Whether an event is accepted depends on the events applied to the same post before it,
+    but not on the events for other posts. So all events within such group can be verified at once.
+    """
+    events_round: List[Event] = []
+    keys: Set[Tuple[str,str]] = set()
+    for event in events:
+        key = (event.server, event.path)
+        if key in keys:
+            yield events_round
+            events_round = []
+            keys = set()
+        events_round.append(event)
+        keys.add(key)
+    if events_round:
+        yield events_round
+
+
+class _PendingEvent:
+    """
+    An event together with the data that its post will have if the event will be accepted.
+    """
+    def __init__(self, event: Event, post: Post, required_users: Set[User]):
+        self.event: Event = event
+        self.post: Post = post
         
-        # Raise exception if post was not verified and therefore created/updated
-        if not success:
-            raise UnauthorizedAction(required_users, verified_users, unverified_usernames)
+        self.required_users: Set[User] = required_users
+        """Users whose approvals we need for this post."""
+        
+        # Add/replace elements from the event,
+        # remove elements which are nulls in the information provided by event.
+        # We work on a copy so that a rejected event leaves the post untouched for the next events.
+        self.data: Dict = dict(post.data)
+        for key, value in event.diff.items():
+            if value is not None:
+                self.data[key] = value
+            elif key in self.data:
+                del self.data[key]
+        
+        self.serialized: bytes = _serialize(post, authors=event.authors, data=self.data)
+        self.signatures: Dict[str,Tuple[bytes,Optional[str]]] = event.parsed_signatures()
+
+
+def _load_posts(keys: Set[Tuple[int,str]]) -> Dict[Tuple[int,str],Post]:
+    return {
+        (post.server_id, post.path): post
+        for post in Post.select().where(SqlTuple(Post.server, Post.path) << keys)
+    }
+
+
+class MissingReference(DoesNotExist):
+    """
+    The event refers to a server, user or parent post that is not known yet. It may become known later.
+    """
+    def __init__(self, message: str, *, post: str = None):
+        super().__init__(message)
+        self.post: Optional[str] = post
+        """Identifier of the missing parent post, if that is what's missing."""
+    
+    def details(self) -> Dict[str,Any]:
+        """Returns information about the exception in a JSON-serializable form."""
+        return {
+            'message': str(self),
+        }
 
 
 class UnauthorizedAction(Exception):
@@ -94,6 +337,15 @@ class UnauthorizedAction(Exception):
         self.verified_users: Set[User] = verified_users
         self.unverified_usernames: Set[str] = unverified_usernames
     
+    def details(self) -> Dict[str,Any]:
+        """Returns information about the exception in a JSON-serializable form."""
+        return {
+            'message': str(self),
+            'required_users': sorted(map(str, self.required_users)),
+            'verified_users': sorted(map(str, self.verified_users)),
+            'unverified_usernames': sorted(self.unverified_usernames),
+        }
+    
     def __str__(self):
         missing_users = self.required_users - self.verified_users
         missing_users_list = ', '.join(sorted(map(str, missing_users)))
@@ -103,4 +355,8 @@ class UnauthorizedAction(Exception):
             unverified_usernames_list = ', '.join(sorted(self.unverified_usernames))
             msg += f'\n  Note: Failed to verify {unverified_usernames_list}.'
         
-        return msg
\ No newline at end of file
+        return msg
+
+
+EventError = Union[UnauthorizedAction, MissingReference]
+"""Why an event could not be applied, see :func:`process_events()`."""
\ No newline at end of file
@@ -1,7 +1,12 @@
-from typing import Union
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
 
+from peewee import Tuple as SqlTuple
+
+from andreas.db.database import db
 from andreas.models.post import Post
+from andreas.models.relations import PostPostRelation, UserPostRelation
 from andreas.models.server import Server
+from andreas.models.user import User
 
 
 def get_post(server: Union[Server,str,int], path: str) -> Post:
@@ -10,13 +15,99 @@ def get_post(server: Union[Server,str,int], path: str) -> Post:
     
     :param server: The :class:`Server<andreas.models.core.Server>` object, or its id, or its name.
     :param path: The path to the required :class:`Post<andreas.models.core.Post>` on the server.
+    
+    The query may go to a replica, see :meth:`Database.for_reading()<andreas.db.database.Database.for_reading>`.
     """
     if isinstance(server, str):
-        return Post.select(Post, Server).join(Server).where(Server.name == server).where(Post.path == path).get()
+        query = Post.select(Post, Server).join(Server).where(Server.name == server)
     else:
-        return Post.get(Post.server == server, Post.path == path)
+        query = Post.select().where(Post.server == server)
+    return query.where(Post.path == path).bind(db.for_reading()).get()
 
 
 def get_post_by_identifier(identifier: str) -> Post:
-    server, path = identifier.split('/')
-    return get_post(server, '/'+path)
\ No newline at end of file
+    return get_post(*split_identifier(identifier))
+
+
+def get_posts_by_identifiers(identifiers: Iterable[str]) -> Dict[str,Post]:
+    """
+    Returns a dict that maps each of given identifiers to its post, loading all of them with a single query.
+    Identifiers of posts that don't exist are not included.
+    """
+    keys = set(split_identifier(identifier) for identifier in identifiers)
+    if not keys:
+        return {}
+    return {
+        post.server.name + post.path: post
+        for post in (Post.select(Post, Server)
+            .join(Server)
+            .where(SqlTuple(Server.name, Post.path) << keys)
+            .bind(db.for_reading()))
+    }
+
+
+def split_identifier(identifier: str) -> Tuple[str,str]:
+    """
+    Splits a post identifier such as ``server/some/path`` into the server name and the path (``/some/path``).
+    Server names can't contain slashes, so everything after the first one belongs to the path.
+    """
+    server, _, path = identifier.partition('/')
+    return server, '/' + path
+
+
+class ThreadEntry(NamedTuple):
+    post: Post
+    parent_id: int
+    """Id of the post that this one comments."""
+    depth: int
+    """1 for direct comments of the thread's root, 2 for comments of comments, and so on."""
+    path: List[int]
+    """Ids of all posts from the root's direct comment down to this post. Pass it as `after` to get the next page."""
+    authors: List[str]
+    """Authors of the post, as ``user@server`` strings."""
+
+
+def get_thread(post: Union[Post,int], *, depth: Optional[int] = None, limit: int = 100,
+    after: Optional[Sequence[int]] = None
+) -> List[ThreadEntry]:
+    """
+    Returns comments of `post`, comments of these comments and so on, in depth-first order,
+    with every post's replies ordered by id. A page is loaded with a single query, together with the authors.
+    
+    :param depth: How many levels of comments to load. All of them by default.
+    :param limit: Maximum number of entries to return.
+    :param after: :data:`ThreadEntry.path` of the last entry of the previous page.
+        Only the ids of the thread are walked again for every page, the posts before it are never fetched.
+    """
+    query = Post.raw(
+        f'''
+        with recursive thread (id, parent_id, depth, path) as (
+            select source_id, target_id, 1, array[source_id]
+            from {PostPostRelation.table()}
+            where target_id = %s and type = 'comments'
+            union all
+            select r.source_id, r.target_id, t.depth + 1, t.path || r.source_id
+            from thread t
+            join {PostPostRelation.table()} r on r.target_id = t.id and r.type = 'comments'
+            where (%s::int is null or t.depth < %s) and r.source_id <> all(t.path)
+        )
+        select post.*, t.parent_id thread_parent_id, t.depth thread_depth, t.path thread_path, array(
+            select u.name || '@' || s.name
+            from {UserPostRelation.table()} ur
+            join {User.table()} u on u.id = ur.source_id
+            join {Server.table()} s on s.id = u.server_id
+            where ur.target_id = post.id and ur.type = 'wrote'
+            order by 1
+        ) thread_authors
+        from thread t
+        join {Post.table()} post on post.id = t.id
+        where t.path > %s::int[]
+        order by t.path
+        limit %s
+        ''',
+        getattr(post, 'id', post), depth, depth, list(after or []), limit)
+    
+    return [
+        ThreadEntry(p, p.thread_parent_id, p.thread_depth, p.thread_path, p.thread_authors)
+        for p in query.bind(db.for_reading())
+    ]
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Durable ingestion queue built on top of the :class:`Event<andreas.models.event.Event>` table.
+
+Any number of workers, in any number of processes and hosts, can call :func:`process_queue()` at the same time.
+Each of them claims its own batch of events with ``FOR UPDATE SKIP LOCKED``, so workers never wait for each other
+and never process the same event twice. Events of the same post are still applied in the order they were received.
+"""
+from datetime import timedelta
+from typing import List
+
+from peewee import SQL, Tuple as SqlTuple, fn
+
+from andreas.db.database import db
+from andreas.functions.process_event import process_events
+from andreas.models.event import Event
+
+
+def claim_events(limit: int, *, stale_after: timedelta = timedelta(minutes=10), max_attempts: int = 5,
+    retry_backoff: timedelta = timedelta(seconds=30)
+) -> List[Event]:
+    """
+    Marks up to `limit` events as being processed and returns them in the order they were received.
+    
+    Pending events are claimed, as well as events that were claimed more than `stale_after` ago
+    but never finished (probably because their worker died).
+    Events waiting for a retry are claimed again `retry_backoff` after their last claim,
+    and the backoff doubles with every attempt.
+    Events that were already claimed `max_attempts` times are marked as ``failed`` instead,
+    see :func:`requeue_events()`.
+    
+    An event is only claimed if all earlier events of its post are finished or claimed together with it,
+    so that another worker can't apply them out of order.
+    """
+    stale = SQL('now() - %s', (stale_after,))
+    retry_due = SQL('coalesce(claimed, received) < now() - %s * power(2, attempts)', (retry_backoff,))
+    unfinished = (Event.status == Event.RETRY) | ((Event.status == Event.PROCESSING) & (Event.claimed < stale))
+    claimable = (Event
+        .select(Event.id, Event.server, Event.path, Event.received)
+        .where(
+            (Event.status == Event.PENDING) |
+            ((Event.status == Event.RETRY) & retry_due) |
+            ((Event.status == Event.PROCESSING) & (Event.claimed < stale)))
+        .where(Event.attempts < max_attempts)
+        .order_by(Event.id)
+        .limit(limit)
+        .for_update('FOR UPDATE SKIP LOCKED'))
+    
+    with db.atomic():
+        Event.update(status=Event.FAILED).where(unfinished, Event.attempts >= max_attempts).execute()
+        candidates = list(claimable)
+        ids = [event.id for event in _without_blocked(candidates)]
+        if not ids:
+            return []
+        
+        events = list(Event
+            .update(status=Event.PROCESSING, attempts=Event.attempts + 1, claimed=fn.now())
+            .where(Event.id << ids)
+            .returning(Event)
+            .execute())
+    
+    return sorted(events, key=lambda event: (event.received, event.id))
+
+
+def _without_blocked(candidates: List[Event]) -> List[Event]:
+    """
+    Leaves out the candidates that have to wait for an earlier unfinished event of the same post,
+    which is not among the candidates: it is pending, waiting for a retry or being processed by another worker.
+    """
+    keys = set((event.server, event.path) for event in candidates if event.path is not None)
+    if not keys:
+        return candidates
+    
+    # The earliest unfinished event of every post that is not claimed now
+    blockers = (Event
+        .select(Event.server, Event.path, Event.received, Event.id)
+        .distinct(Event.server, Event.path)
+        .where(
+            Event.status << (Event.PENDING, Event.PROCESSING, Event.RETRY),
+            SqlTuple(Event.server, Event.path) << list(keys),
+            Event.id.not_in([event.id for event in candidates]))
+        .order_by(Event.server, Event.path, Event.received, Event.id)
+        .tuples())
+    first_blocked = {(server, path): (received, id) for server, path, received, id in blockers}
+    
+    return [
+        event for event in candidates
+        if (event.server, event.path) not in first_blocked
+        or (event.received, event.id) < first_blocked[(event.server, event.path)]
+    ]
+
+
+def process_queue(batch_size: int = 100, **kwargs) -> int:
+    """
+    Claims a batch of events and processes them.
+    :func:`process_events()<andreas.functions.process_event.process_events>` records the outcome of each one.
+    Additional arguments are passed to :func:`claim_events()`.
+    Returns the number of claimed events, so zero means that the queue is empty.
+    """
+    events = claim_events(batch_size, **kwargs)
+    if not events:
+        return 0
+    
+    try:
+        process_events(events, order_by_received=True)
+    except Exception:
+        # Something is wrong with at least one of the events,
+        # so process them one by one to find out which ones can't be processed
+        for event in events:
+            try:
+                process_events([event])
+            except Exception as e:
+                (Event
+                    .update(status=Event.RETRY, error={'message': f'{type(e).__name__}: {e}'})
+                    .where(Event.id == event.id)
+                    .execute())
+    
+    return len(events)
+
+
+def requeue_events(status: str = Event.FAILED) -> int:
+    """
+    Makes all events with given `status` pending again, as if they had just arrived, and returns their number.
+    This is useful after the reason of the failures has been fixed, or to check rejected events again.
+    """
+    return (Event
+        .update(status=Event.PENDING, attempts=0, claimed=None, error=None)
+        .where(Event.status == status)
+        .execute())
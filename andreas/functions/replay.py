@@ -0,0 +1,243 @@
+"""
+Rebuilds posts, relations and signatures by applying the event log again,
+either from the latest :mod:`snapshots<andreas.functions.snapshots>` of the posts or from the very beginning.
+
+Events are split into partitions by their post, so that all events of a post get into the same partition
+and are applied in the order they were received. Partitions are replayed in parallel by separate processes.
+Every batch of events is committed together with the partition's :class:`ReplayCheckpoint`,
+so an interrupted replay continues where it stopped.
+"""
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait
+from time import monotonic, sleep
+from typing import List
+
+from peewee import JOIN, ModelSelect, SQL, Tuple as SqlTuple, fn
+
+from andreas.db.database import db
+from andreas.functions.process_event import MissingReference, process_events
+from andreas.functions.querying import split_identifier
+from andreas.models.event import Event
+from andreas.models.post import Post
+from andreas.models.relations import PostPostRelation, UserPostRelation
+from andreas.models.replay import ReplayCheckpoint
+from andreas.models.server import Server
+from andreas.models.signature import Signature, UnverifiedSignature
+from andreas.models.snapshot import PostSnapshot
+from andreas.models.user import User
+
+
+def replay(workers: int = 4, *, resume: bool = False, from_snapshots: bool = True, batch_size: int = 1000,
+    report_interval: float = 10.0, max_wait: float = 60.0):
+    """
+    Replays the event log with `workers` processes, printing the throughput every `report_interval` seconds.
+    
+    With `from_snapshots`, every post is first reset to its latest snapshot, see :func:`_reset_to_snapshots()`,
+    and only the events after the snapshot are replayed. Posts keep their ids.
+    Otherwise, all posts, relations, signatures and snapshots are deleted and the whole log is replayed.
+    With `resume`, the replay continues from the checkpoints of the previous one, with the same number of workers.
+    
+    Ingestion should be stopped while the replay runs.
+    """
+    if resume:
+        partitions = ReplayCheckpoint.select(fn.max(ReplayCheckpoint.partitions)).scalar()
+        if partitions is not None and partitions != workers:
+            raise ValueError(f'The previous replay had {partitions} workers, it can only be resumed with as many')
+    elif from_snapshots:
+        with db.atomic():
+            _reset_to_snapshots()
+            db.execute_sql(f'truncate {ReplayCheckpoint.table()} restart identity')
+    else:
+        with db.atomic():
+            tables = [Post, PostPostRelation, UserPostRelation, Signature, UnverifiedSignature, PostSnapshot,
+                ReplayCheckpoint]
+            db.execute_sql(f'truncate {", ".join(model.table() for model in tables)} restart identity')
+    
+    # Connections must not be shared with the forked processes
+    db.close()
+    
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(replay_partition, partition, workers, batch_size=batch_size, max_wait=max_wait)
+            for partition in range(workers)
+        ]
+        
+        started = monotonic()
+        initial = last = _processed()
+        while wait(futures, timeout=report_interval).not_done:
+            processed = _processed()
+            print(f'{processed} events replayed, {(processed - last) / report_interval:.0f} events/s', file=sys.stderr)
+            last = processed
+        
+        # Raise the exceptions of the workers, if any
+        for future in futures:
+            future.result()
+    
+    if from_snapshots:
+        _delete_empty_posts()
+    
+    processed = _processed()
+    elapsed = monotonic() - started
+    print(f'Done: {processed} events replayed, {(processed - initial) / elapsed:.0f} events/s', file=sys.stderr)
+    db.close()
+
+
+def _reset_to_snapshots():
+    """
+    Resets the data and :data:`last event<Post.last_event>` of every post to its latest snapshot,
+    or empties the post if it has no snapshots, so that only the events after the snapshots have to be replayed.
+    
+    Relations are reset along with the data: authors are taken from the snapshots,
+    and comment relations are only kept for the posts with snapshots.
+    Signatures of the events that will be replayed are deleted, they will be saved again.
+    """
+    db.execute_sql(f'''
+        create temporary table latest_snapshot on commit drop as
+        select distinct on (snapshot.post_id) snapshot.post_id, snapshot.event_id, snapshot.data, snapshot.authors
+        from {PostSnapshot.table()} snapshot
+        join {Event.table()} e on e.id = snapshot.event_id
+        order by snapshot.post_id, e.received desc, e.id desc
+    ''')
+    db.execute_sql(f'''
+        update {Post.table()} post set data = coalesce(latest.data, '{{}}'), last_event_id = latest.event_id
+        from {Post.table()} p left join latest_snapshot latest on latest.post_id = p.id
+        where post.id = p.id
+    ''')
+    
+    db.execute_sql(f'''
+        delete from {UserPostRelation.table()} r using {User.table()} u, {Server.table()} s
+        where r.type = 'wrote' and u.id = r.source_id and s.id = u.server_id and not exists (
+            select 1 from latest_snapshot latest
+            where latest.post_id = r.target_id and u.name || '@' || s.name = any(latest.authors))
+    ''')
+    db.execute_sql(f'''
+        insert into {UserPostRelation.table()} (source_id, type, target_id, created, modified)
+        select u.id, 'wrote', latest.post_id, now(), now()
+        from latest_snapshot latest
+        cross join unnest(latest.authors) author
+        join {Server.table()} s on s.name = substring(author from '@([^@]*)$')
+        join {User.table()} u on u.server_id = s.id and u.name || '@' || s.name = author
+        on conflict do nothing
+    ''')
+    db.execute_sql(f'''
+        delete from {PostPostRelation.table()} r
+        where r.type = 'comments'
+            and not exists (select 1 from latest_snapshot latest where latest.post_id = r.source_id)
+    ''')
+    
+    to_replay = _not_applied(_replayable(Event.select(Event.id)))
+    for model in Signature, UnverifiedSignature:
+        model.delete().where(model.event << to_replay).execute()
+
+
+def _delete_empty_posts():
+    """
+    Deletes the posts that were reset by :func:`_reset_to_snapshots()` but got no events during the replay,
+    unless something still refers to them.
+    """
+    db.execute_sql(f'''
+        delete from {Post.table()} post
+        where post.last_event_id is null
+            and not exists (select 1 from {PostSnapshot.table()} r where r.post_id = post.id)
+            and not exists (select 1 from {PostPostRelation.table()} r where post.id in (r.source_id, r.target_id))
+            and not exists (select 1 from {UserPostRelation.table()} r where r.target_id = post.id)
+            and not exists (select 1 from {Signature.table()} r where r.post_id = post.id)
+            and not exists (select 1 from {UnverifiedSignature.table()} r where r.post_id = post.id)
+    ''')
+
+
+def replay_partition(partition: int, partitions: int, *, batch_size: int = 1000, max_wait: float = 60.0):
+    """
+    Replays the events of one partition, starting after its checkpoint.
+    Only the events that were applied before are replayed, see :func:`_replayable()`,
+    and only if they are not applied to their post yet, see :func:`_not_applied()`.
+    
+    An event may comment a post of another partition that wasn't replayed yet.
+    Then the batch is retried until the other partition catches up, for at most `max_wait` seconds.
+    After that, the batch is applied without such events, and they are counted as skipped.
+    Events that refer to something no partition is going to create are skipped right away.
+    """
+    checkpoint, _ = ReplayCheckpoint.get_or_create(partition=partition, defaults={'partitions': partitions})
+    
+    while True:
+        query = _not_applied(_replayable(Event.select())).where(_partition_sql(partitions) == partition)
+        if checkpoint.event_id is not None:
+            query = query.where(SqlTuple(Event.received, Event.id) > SqlTuple(checkpoint.received, checkpoint.event_id))
+        events = list(query.order_by(Event.received, Event.id).limit(batch_size))
+        if not events:
+            break
+        
+        waiting_since = monotonic()
+        while True:
+            try:
+                with db.atomic():
+                    errors = process_events(events, lock_posts=False, update_status=False)
+                    missing = [error for error in errors.values() if isinstance(error, MissingReference)]
+                    if (missing and monotonic() - waiting_since < max_wait
+                        and _replayed_elsewhere([error.post for error in missing if error.post], partition, partitions)
+                    ):
+                        raise _RetryBatch
+                    _save_checkpoint(checkpoint, events, processed=len(events) - len(missing), skipped=len(missing))
+                break
+            except _RetryBatch:
+                sleep(1)
+
+
+def _replayable(query: ModelSelect) -> ModelSelect:
+    """
+    Filters the events that are replayed: the ones that were applied, except for duplicates of other events.
+    Rejected events and events that have not been processed yet are left out.
+    """
+    return query.where(
+        Event.path.is_null(False),
+        Event.status == Event.DONE,
+        Event.error.is_null() | ~Event.error.contains('duplicate_of'))
+
+
+def _not_applied(query: ModelSelect) -> ModelSelect:
+    """
+    Filters the events that come after the :data:`last event<Post.last_event>` of their post.
+    Right after :func:`_reset_to_snapshots()`, these are the events after the post's latest snapshot.
+    """
+    LastEvent = Event.alias()
+    return (query
+        .join(Server, JOIN.LEFT_OUTER, on=(Server.name == Event.server))
+        .join(Post, JOIN.LEFT_OUTER, on=((Post.server == Server.id) & (Post.path == Event.path)))
+        .join(LastEvent, JOIN.LEFT_OUTER, on=(LastEvent.id == Post.last_event))
+        .where(
+            LastEvent.id.is_null() |
+            (SqlTuple(Event.received, Event.id) > SqlTuple(LastEvent.received, LastEvent.id))))
+
+
+def _partition_sql(partitions: int) -> SQL:
+    return SQL('mod(abs(hashtext(server || path)::bigint), %s)', (partitions,))
+
+
+def _replayed_elsewhere(identifiers: List[str], partition: int, partitions: int) -> bool:
+    """
+    Tells whether any of the posts with given `identifiers` is created by an event of another partition,
+    so that it is worth to wait for that partition.
+    """
+    if not identifiers:
+        return False
+    keys = list(set(split_identifier(identifier) for identifier in identifiers))
+    return (_replayable(Event.select())
+        .where(SqlTuple(Event.server, Event.path) << keys)
+        .where(_partition_sql(partitions) != partition)
+        .exists())
+
+
+class _RetryBatch(Exception):
+    """Rolls back a batch that has to be replayed again later."""
+
+
+def _save_checkpoint(checkpoint: ReplayCheckpoint, events: List[Event], *, processed: int = 0, skipped: int = 0):
+    checkpoint.received = events[-1].received
+    checkpoint.event_id = events[-1].id
+    checkpoint.processed += processed
+    checkpoint.skipped += skipped
+    checkpoint.save()
+
+
+def _processed() -> int:
+    return ReplayCheckpoint.select(fn.coalesce(fn.sum(ReplayCheckpoint.processed), 0)).scalar()
\ No newline at end of file
@@ -0,0 +1,73 @@
+from typing import Dict, Iterable
+
+from andreas.functions.querying import get_posts_by_identifiers
+from andreas.models.post import Post
+from andreas.models.server import Server
+from andreas.models.user import User
+
+
+class Resolver:
+    """
+    Identity map for servers, users and posts that are referenced by name.
+    
+    Each name is looked up in the database at most once during the resolver's lifetime,
+    and all names that are not known yet are looked up together.
+    A resolver should live no longer than a transaction, because it never sees changes made by others.
+    """
+    def __init__(self):
+        self._servers: Dict[str,Server] = {}
+        self._users: Dict[str,User] = {}
+        self._posts: Dict[str,Post] = {}
+    
+    def servers(self, names: Iterable[str], *, create: bool = False, strict: bool = True) -> Dict[str,Server]:
+        """
+        Returns a dict that maps each of given server names to a server.
+        Raises ``Server.DoesNotExist`` if some of the servers don't exist and `create` is `False`.
+        With `strict` set to `False`, unknown servers are left out instead.
+        """
+        names = set(names)
+        missing = names - self._servers.keys()
+        if missing:
+            self._servers.update(Server.from_names(missing, create=create))
+            
+            unknown = missing - self._servers.keys()
+            if unknown and strict:
+                raise Server.DoesNotExist(f'Unknown servers: {", ".join(sorted(unknown))}')
+        
+        return {name: self._servers[name] for name in names if name in self._servers}
+    
+    def users(self, user_strings: Iterable[str], *, create: bool = False, strict: bool = True) -> Dict[str,User]:
+        """
+        Returns a dict that maps each of given ``user@server`` strings to a user.
+        Raises ``User.DoesNotExist`` if some of the users don't exist and `create` is `False`.
+        With `strict` set to `False`, unknown users are left out instead.
+        """
+        user_strings = set(user_strings)
+        missing = user_strings - self._users.keys()
+        if missing:
+            users = User.from_strings(missing, create=create)
+            self._users.update(users)
+            for user in users.values():
+                user.server = self._servers.setdefault(user.server.name, user.server)
+            
+            unknown = missing - self._users.keys()
+            if unknown and strict:
+                raise User.DoesNotExist(f'Unknown users: {", ".join(sorted(unknown))}')
+        
+        return {user_string: self._users[user_string] for user_string in user_strings if user_string in self._users}
+    
+    def posts(self, identifiers: Iterable[str]) -> Dict[str,Post]:
+        """
+        Returns a dict that maps each of given ``server/path`` identifiers to a post.
+        Unlike other methods, doesn't raise for unknown posts but just leaves them out,
+        and looks them up again next time since they may have been created in the meantime.
+        """
+        identifiers = set(identifiers)
+        missing = identifiers - self._posts.keys()
+        if missing:
+            self._posts.update(get_posts_by_identifiers(missing))
+        return {identifier: self._posts[identifier] for identifier in identifiers if identifier in self._posts}
+    
+    def add_post(self, identifier: str, post: Post):
+        """Remembers a post that was just created or loaded elsewhere."""
+        self._posts[identifier] = post
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Full-text search over posts, using :data:`Post.search_vector<andreas.models.post.Post.search_vector>`
+and its GIN index.
+"""
+from typing import List, NamedTuple, Optional, Tuple
+
+from peewee import Expression, Tuple as SqlTuple, fn
+from playhouse.postgres_ext import TS_MATCH
+
+from andreas.app import app
+from andreas.db.database import db
+from andreas.models.post import Post
+from andreas.models.server import Server
+
+SearchCursor = Tuple[float,int]
+"""The ``rank`` and :data:`Post.id` of the last post of a page."""
+
+
+class SearchPage(NamedTuple):
+    posts: List[Post]
+    """The best matching posts first, each with its ``rank``. Their servers and authors are already loaded."""
+    cursor: Optional[SearchCursor]
+    """Pass it as `after` to get the next page. ``None`` if this page is the last one."""
+
+
+def search_posts(text: str, *, limit: int = 20, after: Optional[SearchCursor] = None) -> SearchPage:
+    """
+    Returns posts that contain all the words of `text`, ordered by ``ts_rank()``.
+    Words are normalized with ``app.config.search.language``, and any punctuation in `text` is ignored.
+    """
+    tsquery = fn.plainto_tsquery(app.config.search.language, text)
+    # ts_rank() returns a float4, which doesn't survive the round trip through a Python float in the cursor
+    rank = fn.ts_rank(Post.search_vector, tsquery).cast('float8')
+    
+    query = (Post.select(Post, Server, rank.alias('rank'))
+        .join(Server)
+        .where(Expression(Post.search_vector, TS_MATCH, tsquery)))
+    if after is not None:
+        query = query.where(SqlTuple(rank, Post.id) < SqlTuple(*after))
+    
+    # Load one extra post to find out whether there is a next page
+    posts = list(query.order_by(rank.desc(), Post.id.desc()).limit(limit + 1).bind(db.for_reading()))
+    cursor = (posts[limit - 1].rank, posts[limit - 1].id) if len(posts) > limit else None
+    return SearchPage(Post.prefetch_authors(posts[:limit]), cursor)
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Snapshots of posts, so that the state of a post at some point of its history can be found
+by applying only the events after the nearest snapshot, instead of all the events since the post was created.
+
+Snapshots are taken by :func:`take_snapshots()`, which should be run periodically (see the ``snapshotposts`` command).
+Events of a post are applied in the order of ``(received, id)``, as the ingestion queue and the replay do,
+so this is the order in which snapshots and events are compared here as well.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+from peewee import Tuple as SqlTuple
+
+from andreas.db.database import db
+from andreas.models.event import Event
+from andreas.models.post import Post
+from andreas.models.server import Server
+from andreas.models.signature import Signature
+from andreas.models.snapshot import PostSnapshot
+from andreas.models.user import User
+
+
+class PostState(NamedTuple):
+    data: Dict[str,Any]
+    authors: List[str]
+    """Authors of the post as ``user@server`` strings, sorted."""
+    event_id: Optional[int]
+    """The last event applied to the post, ``None`` if there were none."""
+
+
+def take_snapshots(min_events: int = 100) -> int:
+    """
+    Takes a snapshot of every post that got at least `min_events` events since its last snapshot.
+    Returns the number of new snapshots.
+    
+    The snapshot refers to the post's :data:`last_event<Post.last_event>`, which is always written
+    in the same transaction as the post's data. Posts that were last changed before that field existed
+    fall back to their latest applied event.
+    """
+    cursor = db.execute_sql(
+        f'''
+        insert into {PostSnapshot.table()} (post_id, event_id, data, authors, created)
+        select post.id, coalesce(post.last_event_id, (
+            select e.id
+            from {Signature.table()} sig
+            join {Event.table()} e on e.id = sig.event_id
+            where sig.post_id = post.id
+            order by e.received desc, e.id desc
+            limit 1
+        )), post.data, array(
+            select u.name || '@' || s.name
+            from {User.table()} u
+            join {Server.table()} s on s.id = u.server_id
+            where u.id = any(post.author_ids)
+            order by 1
+        ), now()
+        from {Post.table()} post
+        left join lateral (
+            select e.received, e.id
+            from {PostSnapshot.table()} snapshot
+            join {Event.table()} e on e.id = snapshot.event_id
+            where snapshot.post_id = post.id
+            order by e.received desc, e.id desc
+            limit 1
+        ) last_snapshot on true
+        join lateral (
+            select count(distinct sig.event_id) events
+            from {Signature.table()} sig
+            join {Event.table()} e on e.id = sig.event_id
+            where sig.post_id = post.id
+                and (last_snapshot.id is null or (e.received, e.id) > (last_snapshot.received, last_snapshot.id))
+        ) applied on applied.events >= %s
+        on conflict do nothing
+        ''',
+        (max(int(min_events), 1),))
+    return cursor.rowcount
+
+
+def post_as_of(post: Union[Post,int], event_id: Optional[int] = None) -> PostState:
+    """
+    Returns the state of `post` right after the event `event_id` (or the latest state by default),
+    starting from the nearest snapshot and applying the events after it.
+    Events that were rejected don't affect the state.
+    """
+    post_id = getattr(post, 'id', post)
+    order = SqlTuple(Event.received, Event.id)
+    
+    until = None
+    if event_id is not None:
+        target = Event.select(Event.id, Event.received).where(Event.id == event_id).get()
+        until = SqlTuple(target.received, target.id)
+    
+    snapshots = (PostSnapshot.select(PostSnapshot, Event.id, Event.received)
+        .join(Event)
+        .where(PostSnapshot.post == post_id))
+    if until is not None:
+        snapshots = snapshots.where(order <= until)
+    snapshot = snapshots.order_by(Event.received.desc(), Event.id.desc()).first()
+    
+    if snapshot:
+        data, authors, last_event_id = dict(snapshot.data), set(snapshot.authors), snapshot.event_id
+    else:
+        data, authors, last_event_id = {}, set(), None
+    
+    # Only events that were applied to the post have signatures that refer to it
+    events = (Event.select(Event.id, Event.authors, Event.diff)
+        .where(Event.id << Signature.select(Signature.event).where(Signature.post == post_id)))
+    if snapshot:
+        events = events.where(order > SqlTuple(snapshot.event.received, snapshot.event.id))
+    if until is not None:
+        events = events.where(order <= until)
+    
+    for event in events.order_by(Event.received, Event.id).iterator():
+        for key, value in event.diff.items():
+            if value is not None:
+                data[key] = value
+            elif key in data:
+                del data[key]
+        authors.update(event.authors)
+        last_event_id = event.id
+    
+    return PostState(data, sorted(authors), last_event_id)
+
+
+def rebuild_post(post: Union[Post,int]) -> PostState:
+    """
+    Restores :data:`Post.data` from the nearest snapshot and the events after it, e.g. after it got corrupted.
+    Returns the restored state.
+    """
+    state = post_as_of(post)
+    Post.update(data=state.data).where(Post.id == getattr(post, 'id', post)).execute()
+    return state
\ No newline at end of file
@@ -1,13 +1,16 @@
+import hashlib
 import json
-from typing import Dict, Iterable, Union
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 import rsa
-from peewee import NodeList, SQL
+from rsa import common, pkcs1, transform
 
+from andreas.app import app
 from andreas.models.event import Event
-from andreas.models.keypair import KeyPair
+from andreas.models.keypair import KeyPair, public_key_cache
 from andreas.models.post import Post
-from andreas.models.server import Server
 from andreas.models.user import User
 
 
@@ -47,22 +50,120 @@ def sign_post(obj: Union[Post,Event], keypair: KeyPair, **kwargs) -> bytes:
     """
     return rsa.sign(_serialize(obj, **kwargs), keypair.privkey, 'SHA-512')
 
-def verify_post(obj: Union[Post,Event], user_string: str, signature: bytes, **kwargs) -> KeyPair:
+def verify_post(obj: Union[Post,Event], user_string: str, signature: bytes, *, fingerprint: str = None, **kwargs
+) -> KeyPair:
     """
     Tries to verify `signature` of object `obj` using a keypair of any user that can be identified by `user_string`.
     If such keypair is found, returns it. Else, raises a ``VerificationError``.
+    
+    If `fingerprint` is given, only the keypair with this :data:`fingerprint<KeyPair.fingerprint>` is tried.
     """
     data = _serialize(obj, **kwargs)
+    if fingerprint is None:
+        cached_keys = public_key_cache.get(user_string)
+    else:
+        cached_keys = list(public_key_cache.get_by_fingerprints([(user_string, fingerprint)]).values())
+    keys = [(key.id, key.pubkey.n, key.pubkey.e) for key in cached_keys]
+    keypair_id = verify_signatures(data, {user_string: signature}, {user_string: keys})[user_string]
+    if keypair_id is None:
+        raise rsa.VerificationError
+    return KeyPair.get(KeyPair.id == keypair_id)
+
+def verify_signatures(data: bytes, signatures: Dict[str,bytes], keys: Dict[str,Sequence[Tuple[int,int,int]]]
+) -> Dict[str,Optional[int]]:
+    """
+    Checks several signatures of the same serialized `data`, made by different users.
+    
+    The SHA-512 digest of `data` is computed only once, and then each signature is checked against it
+    with every candidate key of its user. Candidate keys are given as tuples ``(keypair_id, n, e)``.
+    
+    Returns a dict that maps each user string from `signatures` to the id of the matching keypair,
+    or to ``None`` if none of the user's keys matched.
+    """
+    digest = hashlib.sha512(data).digest()
     
-    for keypair in (KeyPair.select(KeyPair, User, Server)
-        .join(User)
-        .join(Server)
-        .where(NodeList((User.name, SQL("|| '@' ||"), Server.name)) == user_string)
-    ):
-        try:
-            rsa.verify(data, signature, keypair.pubkey)
-            return keypair
-        except rsa.VerificationError:
-            pass
+    # The expected signature block depends only on the digest and the key length,
+    # so we build it once for every key length we encounter
+    expected_blocks: Dict[int,Optional[int]] = {}
     
-    raise rsa.VerificationError
\ No newline at end of file
+    results: Dict[str,Optional[int]] = {}
+    for user_string, signature in signatures.items():
+        results[user_string] = None
+        signature_int = transform.bytes2int(signature)
+        
+        for keypair_id, n, e in keys.get(user_string, ()):
+            keylength = common.byte_size(n)
+            if len(signature) != keylength or signature_int >= n:
+                continue
+            
+            if keylength not in expected_blocks:
+                cleartext = pkcs1.HASH_ASN1['SHA-512'] + digest
+                try:
+                    expected_blocks[keylength] = transform.bytes2int(_pad_for_signing(cleartext, keylength))
+                except OverflowError:
+                    # The key is too short to make SHA-512 signatures at all
+                    expected_blocks[keylength] = None
+            if expected_blocks[keylength] is None:
+                continue
+            
+            if pow(signature_int, e, n) == expected_blocks[keylength]:
+                results[user_string] = keypair_id
+                break
+    
+    return results
+
+def _pad_for_signing(cleartext: bytes, keylength: int) -> bytes:
+    """
+    Pads `cleartext` into a PKCS#1 v1.5 signature block of `keylength` bytes (RFC 8017, section 9.2),
+    like ``rsa.sign()`` does internally. Raises ``OverflowError`` if the key is too short for it.
+    """
+    padding_length = keylength - len(cleartext) - 3
+    if padding_length < 8:
+        raise OverflowError(f'{len(cleartext)} bytes do not fit into a signature block of {keylength} bytes')
+    return b'\x00\x01' + b'\xff' * padding_length + b'\x00' + cleartext
+
+
+VerificationJob = Tuple[bytes, Dict[str,bytes], Dict[str,Sequence[Tuple[int,int,int]]]]
+"""
+Arguments for :func:`verify_signatures()`: serialized data, signatures by users and candidate keys by users.
+Only plain values are used so that jobs can be cheaply sent to another process.
+"""
+
+def _run_verification_job(job: VerificationJob) -> Dict[str,Optional[int]]:
+    return verify_signatures(*job)
+
+
+class VerificationExecutor:
+    """
+    Checks many signatures at once, possibly in a pool of worker processes.
+    
+    RSA verification is pure Python and holds the GIL,
+    so a pool of processes is the only way to use more than one core for it.
+    With zero `workers`, all jobs are run synchronously in the calling process.
+    """
+    def __init__(self, workers: int = 0, chunksize: int = 16):
+        self.workers: int = workers
+        self.chunksize: int = chunksize
+        self._pool: Optional[ProcessPoolExecutor] = None
+    
+    def verify(self, jobs: Iterable[VerificationJob]) -> List[Dict[str,Optional[int]]]:
+        """
+        For each job, returns the result of :func:`verify_signatures()`.
+        The results are returned in the same order as the jobs.
+        """
+        if not self.workers:
+            return list(map(_run_verification_job, jobs))
+        
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        return list(self._pool.map(_run_verification_job, jobs, chunksize=self.chunksize))
+    
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+@lru_cache(1)
+def verification_executor() -> VerificationExecutor:
+    """Returns the executor configured by ``app.config.verifying``."""
+    return VerificationExecutor(app.config.verifying.workers, app.config.verifying.chunksize)
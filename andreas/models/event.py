@@ -1,14 +1,31 @@
+import hashlib
+import json
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
-from peewee import Check, DateTimeField, ForeignKeyField, PrimaryKeyField, TextField, fn
+from peewee import (Check, CharField, DateTimeField, ForeignKeyField, IntegrityError, IntegerField, ModelIndex,
+    PrimaryKeyField, SQL, TextField, fn)
 from playhouse.postgres_ext import ArrayField, BinaryJSONField
 
+from andreas.db.database import db
 from andreas.db.model import Model
 from andreas.models.server import Server
 
 
 class Event(Model):
+    class Meta:
+        indexes = (
+            (('status', 'id'), False),
+        )
+    
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    REJECTED = 'rejected'
+    RETRY = 'retry'
+    FAILED = 'failed'
+    STATUSES = (PENDING, PROCESSING, DONE, REJECTED, RETRY, FAILED)
+    
     id: int = PrimaryKeyField()
     received: datetime = DateTimeField(default=fn.now)
     
@@ -36,10 +53,212 @@ class Event(Model):
     diff: Dict[str,Any] = BinaryJSONField(default={}, constraints=[Check("jsonb_typeof(diff) = 'object'")])
     """Changes which should be applied to the post."""
     
-    signatures: Dict[str,str] = BinaryJSONField(default={}, constraints=[Check("jsonb_typeof(signatures) = 'object'")])
+    signatures: Dict[str,Union[str,Dict[str,str]]] = BinaryJSONField(default={},
+        constraints=[Check("jsonb_typeof(signatures) = 'object'")])
     """
     RSA signatures of the resulting post after the diff is applied.
     The event may contain signatures by different users, even from different servers.
     Each key is full user identification (see :meth:`User::from_string()<andreas.models.user.User.from_string>`),
     and each value is the sign made by that user.
-    """
\ No newline at end of file
+    
+    Instead of a plain hex string, the value can also be an object ``{"signature": ..., "key": ...}``
+    where ``key`` is the :data:`fingerprint<andreas.models.keypair.KeyPair.fingerprint>` of the keypair used.
+    In this case only that keypair is checked, see :meth:`parsed_signatures()`.
+    """
+    
+    status: str = CharField(20, default=PENDING, constraints=[
+        SQL(f"default '{PENDING}'"),
+        Check('status in (%s)' % ', '.join(f"'{status}'" for status in STATUSES)),
+    ])
+    """
+    State of the event in the ingestion queue, see :mod:`andreas.functions.queue`.
+    New events are ``pending``. A worker marks them as ``processing`` while working on them,
+    and :func:`process_events()<andreas.functions.process_event.process_events>` marks them as ``done``,
+    or as ``rejected`` if they were not authorized.
+    If processing failed for some other reason, the event is marked as ``retry`` and will be claimed again later.
+    After too many attempts, it is marked as ``failed`` and stays so until it is requeued.
+    """
+    
+    attempts: int = IntegerField(default=0, constraints=[SQL('default 0')])
+    """How many times a worker has claimed this event."""
+    
+    claimed: datetime = DateTimeField(null=True)
+    """When a worker has claimed this event for the last time."""
+    
+    error: Dict[str,Any] = BinaryJSONField(null=True, index=False)
+    """
+    Why the event was rejected or has to be retried.
+    For rejected events, contains the details of
+    :class:`UnauthorizedAction<andreas.functions.process_event.UnauthorizedAction>`.
+    For duplicates found by :func:`hashevents()<andreas.commands.dbcommands.hashevents>`,
+    contains ``duplicate_of``, the id of the event that is stored with the same content.
+    """
+    
+    content_hash: str = TextField(null=True, unique=True)
+    """
+    Hex-encoded SHA-256 of the event's content, see :meth:`compute_content_hash()`.
+    It is filled automatically when the event is saved, and makes sure that every event is stored only once.
+    """
+    
+    def compute_content_hash(self) -> str:
+        """
+        Returns the hash of everything that came from the event's author, as stored in :data:`content_hash`.
+        Fields set by the server that received the event, such as :data:`received_from`, are not included.
+        """
+        content = {
+            'server': self.server,
+            'authors': self.authors,
+            'parent': self.parent,
+            'path': self.path,
+            'diff': self.diff,
+            'signatures': self.signatures,
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+    
+    @classmethod
+    def add_missing_columns(cls):
+        existing_columns = set(column.name for column in db.get_columns(cls._meta.table_name, cls._meta.schema))
+        super().add_missing_columns()
+        
+        if 'status' not in existing_columns:
+            # Events stored before the queue existed were applied right when they arrived
+            cls.update(status=cls.DONE).execute()
+        else:
+            # Statuses introduced later must be allowed by the constraint as well
+            constraint = db.execute_sql(
+                'select pg_get_constraintdef(oid) from pg_constraint '
+                'where conrelid = %s::regclass and conname = %s',
+                (cls.table(), 'event_status_check')).fetchone()
+            if constraint is None or any(f"'{status}'" not in constraint[0] for status in cls.STATUSES):
+                status_check = ', '.join(f"'{status}'" for status in cls.STATUSES)
+                db.execute_sql(
+                    f'alter table {cls.table()} drop constraint if exists event_status_check, '
+                    f'add constraint event_status_check check (status in ({status_check}))')
+    
+    @classmethod
+    def obsolete_indexes(cls) -> List[str]:
+        return ['event_error']
+    
+    def save(self, *args, **kwargs):
+        """
+        Saves the event. If a new event has the same content as one that is already stored,
+        it is :meth:`received<receive()>` as a duplicate instead, and this instance becomes the stored event.
+        """
+        self.content_hash = self.compute_content_hash()
+        if self._pk is not None:
+            return super().save(*args, **kwargs)
+        
+        try:
+            with db.atomic():
+                return super().save(*args, **kwargs)
+        except IntegrityError:
+            stored, created = self.receive(self)
+            if not created:
+                self.id = stored.id
+                self.reload()
+            return int(created)
+    
+    @classmethod
+    def receive(cls, event: 'Event') -> Tuple['Event',bool]:
+        """
+        Saves a newly arrived `event`, unless the same event is already known.
+        
+        In that case, nothing is saved except an :class:`EventSource` that remembers that the event came
+        from one more server, so the duplicate is never verified or applied again.
+        Returns the stored event and whether it is new.
+        """
+        return cls.receive_many([event])[0]
+    
+    @classmethod
+    def receive_many(cls, events: Iterable['Event']) -> List[Tuple['Event',bool]]:
+        """
+        The same as :meth:`receive()` for many events at once, with a few queries regardless of their number.
+        Returns the stored event and whether it is new for each of the `events`, in the same order.
+        """
+        events = list(events)
+        if not events:
+            return []
+        
+        fields = [field for field in cls._meta.sorted_fields if field is not cls._meta.primary_key]
+        rows = []
+        for event in events:
+            event.content_hash = event.compute_content_hash()
+            row = {}
+            for field in fields:
+                if field.name in event.__data__:
+                    row[field.name] = event.__data__[field.name]
+                else:
+                    row[field.name] = field.default() if callable(field.default) else field.default
+            rows.append(row)
+        
+        with db.atomic():
+            inserted = dict(cls.insert_many(rows)
+                .on_conflict_ignore()
+                .returning(cls.content_hash, cls.id)
+                .tuples()
+                .execute())
+            
+            existing_hashes = set(event.content_hash for event in events) - inserted.keys()
+            stored: Dict[str,Event] = {}
+            if existing_hashes:
+                query = cls.select().where(cls.content_hash << existing_hashes)
+                stored = {event.content_hash: event for event in query}
+            
+            result: List[Tuple[Event,bool]] = []
+            sources = []
+            for event in events:
+                if event.content_hash in inserted and event.content_hash not in stored:
+                    event.id = inserted[event.content_hash]
+                    event._dirty.clear()
+                    stored[event.content_hash] = event
+                    result.append((event, True))
+                    continue
+                
+                # Known before, or a repetition within the same batch
+                existing = stored[event.content_hash]
+                if event.received_from_id is not None and event.received_from_id != existing.received_from_id:
+                    sources.append(dict(event=existing.id, server=event.received_from_id,
+                        received=event.received or fn.now()))
+                result.append((existing, False))
+            
+            if sources:
+                EventSource.insert_many(sources).on_conflict_ignore().execute()
+        
+        return result
+    
+    def parsed_signatures(self) -> Dict[str,Tuple[bytes,Optional[str]]]:
+        """
+        Returns :data:`signatures` as a dict that maps each user to a pair ``(signature, key fingerprint)``.
+        The fingerprint is ``None`` if the signature doesn't specify the keypair.
+        """
+        result = {}
+        for user_string, value in self.signatures.items():
+            if isinstance(value, dict):
+                result[user_string] = bytes.fromhex(value['signature']), value.get('key')
+            else:
+                result[user_string] = bytes.fromhex(value), None
+        return result
+
+
+# Unfinished events of a post, in the order they have to be applied, see :func:`andreas.functions.queue.claim_events()`
+Event.add_index(ModelIndex(
+    Event, (Event.server, Event.path, Event.received, Event.id),
+    where=SQL(f"status in ('{Event.PENDING}', '{Event.PROCESSING}', '{Event.RETRY}')"),
+    name='event_unfinished_post'))
+
+
+class EventSource(Model):
+    """
+    A server that sent us an :class:`Event` we already knew, see :meth:`Event.receive()`.
+    The server we got the event from for the first time is stored in :data:`Event.received_from` instead.
+    """
+    class Meta:
+        table_name = 'event_source'
+        indexes = (
+            (('event', 'server'), True),
+        )
+    
+    id: int = PrimaryKeyField()
+    event: Event = ForeignKeyField(Event, on_delete='cascade', related_name='sources', index=False)
+    server: Server = ForeignKeyField(Server, on_update='cascade')
+    received: datetime = DateTimeField(default=fn.now)
\ No newline at end of file
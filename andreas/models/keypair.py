@@ -1,11 +1,16 @@
+import hashlib
+from collections import OrderedDict
 from datetime import datetime
-from typing import Union
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple, Union
 
 import rsa
-from peewee import DateTimeField, ForeignKeyField, PrimaryKeyField, fn
+from peewee import DateTimeField, ForeignKeyField, PrimaryKeyField, TextField, Tuple as SqlTuple, fn
 
 from andreas.db.fields import BlobIntegerField
+from andreas.db.invalidation import notify_sql, on_invalidation
 from andreas.db.model import Model
+from andreas.models.server import Server
 from andreas.models.user import User
 
 
@@ -25,6 +30,14 @@ class KeyPair(Model):
     p: int = BlobIntegerField(null=True)
     q: int = BlobIntegerField(null=True)
     
+    fingerprint: str = TextField(null=True, unique=True)
+    """
+    Hex-encoded SHA-256 of the public key in DER format, see :meth:`compute_fingerprint()`.
+    It is filled automatically when the keypair is saved.
+    Signatures in :data:`Event.signatures<andreas.models.event.Event.signatures>` can refer to it
+    so that the right keypair can be found without trying all keys of the user.
+    """
+    
     @property
     def privkey(self) -> rsa.PrivateKey:
         return rsa.PrivateKey(self.n, self.e, self.d, self.p, self.q)
@@ -33,6 +46,36 @@ class KeyPair(Model):
     def pubkey(self) -> rsa.PublicKey:
         return rsa.PublicKey(self.n, self.e)
     
+    @classmethod
+    def triggers(cls):
+        user_string = (
+            "(select u.name || '@' || s.name from {user} u join {server} s on s.id = u.server_id where u.id = {{}})"
+            .format(user=User.table(), server=Server.table()))
+        notify_new = notify_sql('keypair', f"json_build_object('user', {user_string.format('new.user_id')})")
+        notify_old = notify_sql('keypair', f"json_build_object('user', {user_string.format('old.user_id')})")
+        return {
+            'before update': 'new.modified = now(); return new;',
+            'after insert': f'{notify_new}; return null;',
+            'after update': f'{notify_old}; {notify_new}; return null;',
+            'after delete': f'{notify_old}; return null;',
+        }
+    
+    @staticmethod
+    def compute_fingerprint(key: rsa.PublicKey) -> str:
+        """Returns the fingerprint for given public key, as stored in :data:`fingerprint`."""
+        return hashlib.sha256(key.save_pkcs1('DER')).hexdigest()
+    
+    def save(self, *args, **kwargs):
+        self.fingerprint = self.compute_fingerprint(self.pubkey)
+        result = super().save(*args, **kwargs)
+        public_key_cache.invalidate(repr(self.user))
+        return result
+    
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        public_key_cache.invalidate(repr(self.user))
+        return result
+    
     @classmethod
     def from_privkey(cls, key: rsa.PrivateKey) -> "KeyPair":
         """Given a private key, returns a KeyPair representing all information about it."""
@@ -66,4 +109,150 @@ class KeyPair(Model):
     @property
     def keysize(self) -> int:
         """Returns bit length of the :data:`n` attribute."""
-        return self.n.bit_length()
\ No newline at end of file
+        return self.n.bit_length()
+
+
+class CachedPublicKey(NamedTuple):
+    id: int
+    fingerprint: str
+    pubkey: rsa.PublicKey
+
+
+class PublicKeyCache:
+    """
+    Bounded LRU cache that maps user strings (like ``user@server``) to the public keys of these users.
+    
+    Saving or deleting a :class:`KeyPair` through the model invalidates the entry of its user.
+    Bulk queries like ``KeyPair.delete().where(...)`` bypass this, so call :meth:`clear()` after them.
+    """
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize: int = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: Dict[str,List[CachedPublicKey]] = OrderedDict()
+        self._lock = Lock()
+    
+    def get(self, user_string: str) -> List[CachedPublicKey]:
+        """Returns all known public keys of given user."""
+        return self.get_many([user_string])[user_string]
+    
+    def get_many(self, user_strings: Iterable[str]) -> Dict[str,List[CachedPublicKey]]:
+        """
+        Returns all known public keys for each of given users.
+        Users that are not cached yet are loaded from the database with a single query.
+        
+        They are always loaded from the primary database: a replica may lag behind,
+        and the keys it misses would stay missing in the cache until the next invalidation.
+        """
+        result: Dict[str,List[CachedPublicKey]] = {}
+        missing: List[str] = []
+        with self._lock:
+            for user_string in set(user_strings):
+                if user_string in self._entries:
+                    self._entries.move_to_end(user_string)
+                    result[user_string] = self._entries[user_string]
+                    self.hits += 1
+                else:
+                    missing.append(user_string)
+                    self.misses += 1
+        
+        if missing:
+            # Strings that are not formatted like user@server can't have any keys
+            loaded: Dict[str,List[CachedPublicKey]] = {user_string: [] for user_string in missing}
+            pairs = set(filter(None, map(User.split_string, missing)))
+            if pairs:
+                for keypair in (KeyPair.select(KeyPair, User, Server)
+                    .join(User)
+                    .join(Server)
+                    .where(SqlTuple(User.name, Server.name) << pairs)
+                ):
+                    fingerprint = keypair.fingerprint or KeyPair.compute_fingerprint(keypair.pubkey)
+                    loaded[repr(keypair.user)].append(CachedPublicKey(keypair.id, fingerprint, keypair.pubkey))
+            
+            with self._lock:
+                for user_string, keys in loaded.items():
+                    self._entries[user_string] = keys
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            result.update(loaded)
+        
+        return result
+    
+    def get_by_fingerprints(self, keys: Iterable[Tuple[str,str]]) -> Dict[Tuple[str,str],CachedPublicKey]:
+        """
+        Returns the public keys identified by pairs ``(user string, fingerprint)``.
+        Keys that don't exist or belong to another user are left out.
+        
+        Keys of the users that are cached are taken from the cache. The others are looked up
+        by the unique index on :data:`KeyPair.fingerprint` with a single query,
+        without loading all keys of their users, and therefore without caching them.
+        """
+        result: Dict[Tuple[str,str],CachedPublicKey] = {}
+        missing: Set[Tuple[str,str]] = set()
+        with self._lock:
+            for user_string, fingerprint in set(keys):
+                if user_string in self._entries:
+                    self._entries.move_to_end(user_string)
+                    for key in self._entries[user_string]:
+                        if key.fingerprint == fingerprint:
+                            result[(user_string, fingerprint)] = key
+                    self.hits += 1
+                else:
+                    missing.add((user_string, fingerprint))
+                    self.misses += 1
+        
+        if missing:
+            for keypair in (KeyPair.select(KeyPair, User, Server)
+                .join(User)
+                .join(Server)
+                .where(KeyPair.fingerprint << set(fingerprint for _, fingerprint in missing))
+            ):
+                key = (repr(keypair.user), keypair.fingerprint)
+                if key in missing:
+                    result[key] = CachedPublicKey(keypair.id, keypair.fingerprint, keypair.pubkey)
+        
+        return result
+    
+    def invalidate(self, user_string: str):
+        with self._lock:
+            self._entries.pop(user_string, None)
+    
+    def invalidate_server(self, server_name: str):
+        """Drops the entries of all users of given server."""
+        with self._lock:
+            for user_string in list(self._entries):
+                pair = User.split_string(user_string)
+                if pair is not None and pair[1] == server_name:
+                    del self._entries[user_string]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+public_key_cache = PublicKeyCache()
+
+
+@on_invalidation('keypair')
+def invalidate_public_key_cache_on_keypair(payload):
+    if payload is None:
+        public_key_cache.clear()
+    else:
+        public_key_cache.invalidate(payload['user'])
+
+
+@on_invalidation('user')
+def invalidate_public_key_cache_on_user(payload):
+    if payload is None:
+        public_key_cache.clear()
+    else:
+        public_key_cache.invalidate(payload['user'])
+
+
+@on_invalidation('server')
+def invalidate_public_key_cache_on_server(payload):
+    if payload is None:
+        public_key_cache.clear()
+    elif payload.get('name') != payload['old_name']:
+        # The server was renamed or deleted, so the user strings of all its users are not valid anymore
+        public_key_cache.invalidate_server(payload['old_name'])
\ No newline at end of file
@@ -1,10 +1,16 @@
+from collections import defaultdict
 from datetime import datetime
-from typing import Any, Dict, Iterable
+from typing import Any, Dict, Iterable, List, Optional, Union
 
-from peewee import Check, DateTimeField, ForeignKeyField, PrimaryKeyField, TextField, fn
-from playhouse.postgres_ext import BinaryJSONField
+from peewee import (Check, DateTimeField, ForeignKeyField, IntegerField, ModelIndex, ModelSelect, PrimaryKeyField, SQL,
+    TextField, fn)
+from playhouse.postgres_ext import ArrayField, BinaryJSONField, TSVectorField
+from psycopg2.extras import Json
 
+from andreas.app import app
+from andreas.db.database import db
 from andreas.db.model import Model
+from andreas.models.event import Event
 from andreas.models.server import Server
 from andreas.models.user import User
 
@@ -13,6 +19,8 @@ class Post(Model):
     class Meta:
         indexes = (
             (('server', 'path'), True),
+            (('modified', 'id'), False),
+            (('server', 'modified', 'id'), False),
         )
     
     id: int = PrimaryKeyField()
@@ -30,19 +38,138 @@ class Post(Model):
     As long as we won't mess with it, it doesn't matter for us how exactly the server's routing is done.
     """
     
-    data: Dict[str,Any] = BinaryJSONField(default=lambda: {}, constraints=[Check("jsonb_typeof(data) = 'object'")])
+    data: Dict[str,Any] = BinaryJSONField(default=lambda: {}, index=False,
+        constraints=[Check("jsonb_typeof(data) = 'object'")])
     """
     The entire content of the post in JSON format.
     How some of the values are interpreted may depend on implementation.
     """
     
+    comment_count: int = IntegerField(default=0, constraints=[SQL('default 0')])
+    """
+    Number of posts that comment this one.
+    Maintained by triggers of :class:`PostPostRelation<andreas.models.relations.PostPostRelation>`.
+    """
+    
+    last_activity: datetime = DateTimeField(default=fn.now, constraints=[SQL('default now()')])
+    """
+    When the newest comment was added, or when the post was created if it has no comments.
+    Maintained by triggers of :class:`PostPostRelation<andreas.models.relations.PostPostRelation>`.
+    """
+    
+    author_ids: List[int] = ArrayField(IntegerField, default=lambda: [], index=False, constraints=[SQL("default '{}'")])
+    """
+    Ids of the users who wrote the post, the same as :meth:`authors()` but without a join.
+    Maintained by triggers of :class:`UserPostRelation<andreas.models.relations.UserPostRelation>`.
+    """
+    
+    last_event: Event = ForeignKeyField(Event, null=True, index=False, on_delete='set null')
+    """
+    The last event that was applied to the post, see :meth:`merge_data()`.
+    Events of a post are applied in the order of ``(received, id)``, so no event before this one is missing.
+    """
+    
+    search_vector: str = TSVectorField(null=True)
+    """
+    Words of the values of ``app.config.search.keys`` in the data, for :func:`andreas.functions.search.search_posts()`.
+    Maintained by the post's own triggers. After changing the config, run ``updatedb`` and then ``reindexsearch``.
+    """
+    
     @classmethod
     def triggers(cls):
         return {
-            'before update': 'new.modified = now(); return new;',
+            'before insert': f'new.search_vector = {cls.search_vector_sql("new")}; return new;',
+            
+            # Counters are updated by other tables' triggers, this shouldn't count as a modification of the post
+            'before update': f'''
+                if (new.server_id, new.path, new.data) is distinct from (old.server_id, old.path, old.data) then
+                    new.modified = now();
+                end if;
+                if new.data is distinct from old.data then
+                    new.search_vector = {cls.search_vector_sql("new")};
+                end if;
+                return new;
+            ''',
         }
     
+    @classmethod
+    def obsolete_indexes(cls):
+        # The default GIN index on the data was replaced by post_data_path_ops
+        return ['post_data', 'post_author_ids']
+    
+    @staticmethod
+    def search_vector_sql(row: str) -> str:
+        """
+        Returns SQL expression that computes :data:`search_vector` of a post stored in the variable `row`.
+        Values of the first keys get the higher weights, so that e.g. matches in titles are ranked above those in bodies.
+        """
+        language = app.config.search.language.replace("'", "''")
+        parts = []
+        for i, key in enumerate(app.config.search.keys):
+            key = key.replace("'", "''")
+            weight = 'ABCD'[min(i, 3)]
+            parts.append(f"setweight(to_tsvector('{language}', coalesce({row}.data->>'{key}', '')), '{weight}')")
+        return ' || '.join(parts) or "''::tsvector"
+    
+    _authors: Optional[List[User]] = None
+    
     def authors(self) -> Iterable[User]:
-        for rel in self.incoming_relations_user_post:
-            if rel.type == 'wrote':
-                yield rel.source
\ No newline at end of file
+        """
+        Returns users who wrote the post.
+        If the authors were loaded by :meth:`prefetch_authors()`, returns them without querying the database.
+        """
+        if self._authors is not None:
+            return list(self._authors)
+        return [rel.source for rel in Post._authors_query([self.id])]
+    
+    @classmethod
+    def prefetch_authors(cls, posts: Iterable['Post']) -> List['Post']:
+        """
+        Loads authors of all given posts with a single query and attaches them to the posts,
+        so that :meth:`authors()` doesn't have to query the database. Returns the posts as a list.
+        """
+        posts = list(posts)
+        authors: Dict[int,List[User]] = defaultdict(list)
+        if posts:
+            for rel in cls._authors_query(set(post.id for post in posts)):
+                authors[rel.target_id].append(rel.source)
+        for post in posts:
+            post._authors = authors[post.id]
+        return posts
+    
+    @classmethod
+    def _authors_query(cls, post_ids: Iterable[int]) -> ModelSelect:
+        relation = cls.incoming_relations_user_post.rel_model
+        return (relation.select(relation, User, Server)
+            .join(User)
+            .join(Server)
+            .where(relation.target << post_ids, relation.type == 'wrote')
+            .order_by(relation.id)
+            .bind(db.for_reading()))
+    
+    @classmethod
+    def merge_data(cls, server: Union[Server,int], path: str, diff: Dict[str,Any], event: Union[Event,int] = None
+    ) -> int:
+        """
+        Applies `diff` to the post's :data:`data` right in the database, creating the post if it doesn't exist.
+        Keys with non-null values are added or replaced, keys with null values are removed.
+        If the diff comes from an `event`, it is stored as the post's :data:`last_event`.
+        
+        This is a single ``INSERT ... ON CONFLICT DO UPDATE`` statement, so the document is never transferred
+        and concurrent merges into the same post don't overwrite each other. Returns the post's id.
+        """
+        added = {key: value for key, value in diff.items() if value is not None}
+        removed = [key for key, value in diff.items() if value is None]
+        cursor = db.execute_sql(
+            f'insert into {cls.table()} as post (server_id, path, data, last_event_id, created, modified) '
+            f'values (%s, %s, %s, %s, now(), now()) '
+            f'on conflict (server_id, path) do update '
+            f'set data = (post.data || excluded.data) - %s::text[], '
+            f'last_event_id = coalesce(excluded.last_event_id, post.last_event_id), modified = now() '
+            f'returning id',
+            (getattr(server, 'id', server), path, Json(added), getattr(event, 'id', event), removed))
+        return cursor.fetchone()[0]
+
+
+# Containment queries over the data (``data @> '{"tags": ["Aaa"]}'``), see :func:`andreas.functions.feeds.find_posts()`
+Post.add_index(ModelIndex(Post, (SQL('data jsonb_path_ops'),), using='gin', name='post_data_path_ops'))
\ No newline at end of file
@@ -10,6 +10,10 @@ from andreas.models.user import User
 class PostPostRelation(Model):
     class Meta:
         table_name = 'relation_post_post'
+        indexes = (
+            (('source', 'type', 'target'), True),
+            (('target', 'type'), False),
+        )
     
     id: int = PrimaryKeyField()
     created: datetime = DateTimeField(default=fn.now)
@@ -23,12 +27,29 @@ class PostPostRelation(Model):
     def triggers(cls):
         return {
             'before update': 'new.modified = now(); return new;',
+            'after insert': f'''
+                if new.type = 'comments' then
+                    update {Post.table()}
+                    set comment_count = comment_count + 1, last_activity = greatest(last_activity, new.created)
+                    where id = new.target_id;
+                end if;
+                return null;
+            ''',
+            'after delete': f'''
+                if old.type = 'comments' then
+                    update {Post.table()} set comment_count = comment_count - 1 where id = old.target_id;
+                end if;
+                return null;
+            ''',
         }
 
 
 class UserPostRelation(Model):
     class Meta:
         table_name = 'relation_user_post'
+        indexes = (
+            (('source', 'type', 'target'), True),
+        )
     
     id: int = PrimaryKeyField()
     created: datetime = DateTimeField(default=fn.now)
@@ -42,4 +63,18 @@ class UserPostRelation(Model):
     def triggers(cls):
         return {
             'before update': 'new.modified = now(); return new;',
+            'after insert': f'''
+                if new.type = 'wrote' then
+                    update {Post.table()} set author_ids = array_append(author_ids, new.source_id)
+                    where id = new.target_id and new.source_id <> all(author_ids);
+                end if;
+                return null;
+            ''',
+            'after delete': f'''
+                if old.type = 'wrote' then
+                    update {Post.table()} set author_ids = array_remove(author_ids, old.source_id)
+                    where id = old.target_id;
+                end if;
+                return null;
+            ''',
         }
\ No newline at end of file
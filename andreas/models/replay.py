@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from peewee import DateTimeField, IntegerField, fn
+
+from andreas.db.model import Model
+
+
+class ReplayCheckpoint(Model):
+    """
+    Progress of one partition of the event log replay, see :mod:`andreas.functions.replay`.
+    """
+    partition: int = IntegerField(primary_key=True)
+    partitions: int = IntegerField()
+    """Total number of partitions. A replay can only be resumed with the same number."""
+    
+    received: datetime = DateTimeField(null=True)
+    event_id: int = IntegerField(null=True)
+    """:data:`Event.received` and :data:`Event.id` of the last replayed event of the partition."""
+    
+    processed: int = IntegerField(default=0)
+    """Number of replayed events."""
+    
+    skipped: int = IntegerField(default=0)
+    """Number of events that could not be replayed because some server, user or parent post was missing."""
+    
+    modified: datetime = DateTimeField(default=fn.now)
+    
+    @classmethod
+    def triggers(cls):
+        return {
+            'before update': 'new.modified = now(); return new;',
+        }
\ No newline at end of file
@@ -1,8 +1,10 @@
 from datetime import datetime
 from functools import lru_cache
+from typing import Dict, Iterable
 
 from peewee import BooleanField, CharField, DateTimeField, PrimaryKeyField, TextField, fn
 
+from andreas.db.invalidation import notify_sql, on_invalidation
 from andreas.db.model import Model
 
 
@@ -11,7 +13,7 @@ class Server(Model):
     created: datetime = DateTimeField(default=fn.now)
     modified: datetime = DateTimeField(default=fn.now)
     
-    name: str = TextField()
+    name: str = TextField(unique=True)
     """Server's identificator. Can contain any symbols but ``/``."""
     
     engine_name: str = CharField(50, null=True)
@@ -24,11 +26,41 @@ class Server(Model):
     
     @classmethod
     def triggers(cls):
+        notify_update = notify_sql('server', "json_build_object('id', new.id, 'name', new.name, 'old_name', old.name)")
+        notify_delete = notify_sql('server', "json_build_object('id', old.id, 'old_name', old.name)")
         return {
             'before update': 'new.modified = now(); return new;',
+            # A new server can't be cached anywhere yet, so only updates and deletes are announced
+            'after update': f'{notify_update}; return null;',
+            'after delete': f'{notify_delete}; return null;',
         }
     
     @classmethod
     @lru_cache(1)
     def local(cls) -> "Server":
-        return cls.get(Server.is_local == True)
\ No newline at end of file
+        return cls.get(Server.is_local == True)
+    
+    @classmethod
+    def from_names(cls, names: Iterable[str], *, create: bool = False) -> Dict[str,"Server"]:
+        """
+        Given server names, returns a dict that maps each of them to a server, using a single query.
+        Unknown names are omitted from the result, unless `create` is `True`:
+        in that case, all the missing servers are added to database with one more query.
+        """
+        names = set(names)
+        if not names:
+            return {}
+        
+        servers = {server.name: server for server in cls.select().where(cls.name << names)}
+        
+        missing = names - servers.keys()
+        if create and missing:
+            cls.insert_many([dict(name=name) for name in missing]).on_conflict_ignore().execute()
+            servers.update((server.name, server) for server in cls.select().where(cls.name << missing))
+        
+        return servers
+
+
+@on_invalidation('server')
+def invalidate_local_server(payload):
+    Server.local.cache_clear()
\ No newline at end of file
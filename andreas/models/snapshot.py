@@ -0,0 +1,38 @@
+from datetime import datetime
+from typing import Any, Dict, List
+
+from peewee import DateTimeField, ForeignKeyField, PrimaryKeyField, TextField, fn
+from playhouse.postgres_ext import ArrayField, BinaryJSONField
+
+from andreas.db.model import Model
+from andreas.models.event import Event
+from andreas.models.post import Post
+
+
+class PostSnapshot(Model):
+    """
+    State of a post right after a certain event was applied to it, see :mod:`andreas.functions.snapshots`.
+    """
+    class Meta:
+        table_name = 'post_snapshot'
+        indexes = (
+            (('post', 'event'), True),
+        )
+    
+    id: int = PrimaryKeyField()
+    created: datetime = DateTimeField(default=fn.now)
+    
+    post: Post = ForeignKeyField(Post, on_delete='cascade', related_name='snapshots')
+    
+    event: Event = ForeignKeyField(Event, index=False)
+    """The last event that was applied to the post before the snapshot was taken."""
+    
+    data: Dict[str,Any] = BinaryJSONField(index=False)
+    """Copy of :data:`Post.data`."""
+    
+    authors: List[str] = ArrayField(TextField, index=False)
+    """Authors of the post as ``user@server`` strings."""
+    
+    @classmethod
+    def obsolete_indexes(cls):
+        return ['postsnapshot_authors']
\ No newline at end of file
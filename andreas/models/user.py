@@ -1,13 +1,19 @@
 from datetime import datetime
-from typing import Union
+from typing import Dict, Iterable, Optional, Set, Tuple, Union
 
-from peewee import DateTimeField, ForeignKeyField, PrimaryKeyField, TextField, fn
+from peewee import DateTimeField, ForeignKeyField, PrimaryKeyField, TextField, Tuple as SqlTuple, fn
 
+from andreas.db.invalidation import notify_sql
 from andreas.db.model import Model
 from andreas.models.server import Server
 
 
 class User(Model):
+    class Meta:
+        indexes = (
+            (('server', 'name'), True),
+        )
+    
     id: int = PrimaryKeyField()
     created: datetime = DateTimeField(default=fn.now)
     modified: datetime = DateTimeField(default=fn.now)
@@ -23,8 +29,17 @@ class User(Model):
     
     @classmethod
     def triggers(cls):
+        notify_old = notify_sql('user', "json_build_object('id', old.id, 'user', old.name || '@' || "
+            f"(select name from {Server.table()} where id = old.server_id))")
         return {
             'before update': 'new.modified = now(); return new;',
+            'after update': f'''
+                if (new.name, new.server_id) is distinct from (old.name, old.server_id) then
+                    {notify_old};
+                end if;
+                return null;
+            ''',
+            'after delete': f'{notify_old}; return null;',
         }
     
     @classmethod
@@ -48,4 +63,54 @@ class User(Model):
                 server, _ = Server.get_or_create(name=server_name)
                 return User.create(server=server, name=user)
             else:
-                raise e
\ No newline at end of file
+                raise e
+    
+    @staticmethod
+    def split_string(identificator: str) -> Optional[Tuple[str,str]]:
+        """
+        Splits a ``user@server`` string into the user's name and the server's name, like :meth:`from_string()`.
+        Returns ``None`` if the string is not formatted like that.
+        """
+        user, at, server_name = identificator.rpartition('@')
+        if not at:
+            return None
+        return user, server_name
+    
+    @classmethod
+    def from_strings(cls, identificators: Iterable[str], *, create: bool = False) -> Dict[str,"User"]:
+        """
+        Bulk version of :meth:`from_string()`: resolves all given ``user@server`` strings with a single query
+        and returns a dict that maps each of them to a user.
+        
+        Strings of unknown users are omitted from the result, unless `create` is `True`:
+        in that case, all the missing servers and users are added to database with a few bulk queries.
+        Strings that are not formatted like ``user@server`` are always omitted.
+        """
+        pairs: Dict[str,Tuple[str,str]] = {}
+        for identificator in set(identificators):
+            pair = cls.split_string(identificator)
+            if pair is not None:
+                pairs[identificator] = pair
+        if not pairs:
+            return {}
+        
+        users = cls._select_by_pairs(set(pairs.values()))
+        
+        missing = set(pair for pair in pairs.values() if pair not in users)
+        if create and missing:
+            servers = Server.from_names(set(server_name for _, server_name in missing), create=True)
+            (cls.insert_many([dict(server=servers[server_name], name=name) for name, server_name in missing])
+                .on_conflict_ignore()
+                .execute())
+            users.update(cls._select_by_pairs(missing))
+        
+        return {identificator: users[pair] for identificator, pair in pairs.items() if pair in users}
+    
+    @classmethod
+    def _select_by_pairs(cls, pairs: Set[Tuple[str,str]]) -> Dict[Tuple[str,str],"User"]:
+        return {
+            (user.name, user.server.name): user
+            for user in (User.select(User, Server)
+                .join(Server)
+                .where(SqlTuple(User.name, Server.name) << pairs))
+        }
\ No newline at end of file
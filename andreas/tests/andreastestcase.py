@@ -4,7 +4,7 @@ from unittest.case import TestCase
 from peewee import _transaction
 
 from andreas.db.database import db
-from andreas.models.keypair import KeyPair
+from andreas.models.keypair import KeyPair, public_key_cache
 from andreas.models.server import Server
 from andreas.models.user import User
 
@@ -41,6 +41,9 @@ class AndreasTestCase(TestCase):
     def tearDown(self):
         self.transaction.rollback(begin=False)
         self.transaction_context.__exit__(None, None, None)
+        
+        # Cached data may refer to the rows that were just rolled back
+        public_key_cache.clear()
 
 
 class AndreasTestCaseWithKeyPair(AndreasTestCase):
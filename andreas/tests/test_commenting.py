@@ -1,9 +1,11 @@
 from andreas.functions.process_event import process_event
+from andreas.functions.querying import get_thread
 from andreas.functions.verifying import sign_post
 from andreas.models.event import Event
 from andreas.models.post import Post
 from andreas.models.relations import PostPostRelation, UserPostRelation
 from andreas.models.server import Server
+from andreas.models.user import User
 from andreas.tests.andreastestcase import AndreasTestCaseWithKeyPair
 
 
@@ -37,4 +39,54 @@ class TestCommenting(AndreasTestCaseWithKeyPair):
         PostPostRelation.get(
             PostPostRelation.source == comment,
             PostPostRelation.type == 'comments',
-            PostPostRelation.target == self.post)
\ No newline at end of file
+            PostPostRelation.target == self.post)
+    
+    def test_counters(self):
+        comment = Post.select().join(Server).where(Server.name == 'aaa', Post.path == '/post1#c1').get()
+        self.post.reload()
+        self.assertEqual(1, self.post.comment_count)
+        self.assertEqual([self.abraham.id], self.post.author_ids)
+        self.assertEqual(0, comment.comment_count)
+        self.assertEqual([self.bernard.id], comment.author_ids)
+        
+        PostPostRelation.delete().where(PostPostRelation.target == self.post).execute()
+        UserPostRelation.delete().where(UserPostRelation.target == comment).execute()
+        self.post.reload()
+        comment.reload()
+        self.assertEqual(0, self.post.comment_count)
+        self.assertEqual([], comment.author_ids)
+
+
+class TestThread(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        def create(path: str, parent: Post, author: User) -> Post:
+            post = Post.create(server=self.server, path=path)
+            UserPostRelation.create(source=author, type='wrote', target=post)
+            PostPostRelation.create(source=post, type='comments', target=parent)
+            return post
+        
+        self.root = Post.create(server=self.server, path='/post1')
+        self.c1 = create('/post1#c1', self.root, self.abraham)
+        self.c2 = create('/post1#c2', self.root, self.bernard)
+        self.c1_1 = create('/post1#c1.1', self.c1, self.bernard)
+        self.c1_1_1 = create('/post1#c1.1.1', self.c1_1, self.abraham)
+    
+    def test_whole_thread(self):
+        thread = get_thread(self.root)
+        self.assertEqual([self.c1, self.c1_1, self.c1_1_1, self.c2], [entry.post for entry in thread])
+        self.assertEqual([1, 2, 3, 1], [entry.depth for entry in thread])
+        self.assertEqual([self.root.id, self.c1.id, self.c1_1.id, self.root.id], [entry.parent_id for entry in thread])
+        self.assertEqual(['abraham@aaa'], thread[0].authors)
+        self.assertEqual('/post1#c1.1', thread[1].post.path)
+    
+    def test_depth(self):
+        thread = get_thread(self.root, depth=2)
+        self.assertEqual([self.c1, self.c1_1, self.c2], [entry.post for entry in thread])
+    
+    def test_pagination(self):
+        first_page = get_thread(self.root, limit=3)
+        second_page = get_thread(self.root, limit=3, after=first_page[-1].path)
+        self.assertEqual([self.c1, self.c1_1, self.c1_1_1], [entry.post for entry in first_page])
+        self.assertEqual([self.c2], [entry.post for entry in second_page])
\ No newline at end of file
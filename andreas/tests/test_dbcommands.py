@@ -0,0 +1,116 @@
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from peewee import IntegrityError
+
+from andreas.commands.dbcommands import dedupeusers, exportevents, hashevents, importevents
+from andreas.db.database import db
+from andreas.models.event import Event
+from andreas.models.keypair import KeyPair
+from andreas.models.post import Post
+from andreas.models.relations import UserPostRelation
+from andreas.models.server import Server
+from andreas.models.user import User
+from andreas.tests.andreastestcase import AndreasTestCase, AndreasTestCaseWithKeyPair
+
+
+class TestExportImport(AndreasTestCase):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.paths = ['/post1', '/post2', '/post\\3\n"quoted"']
+        for path in self.paths:
+            Event.create(server='aaa', authors=['abraham@aaa'], path=path, diff={'body': f'Post at {path}'},
+                signatures={'abraham@aaa': 'abcd'})
+    
+    def test_export_import(self):
+        count = Event.select().count()
+        
+        with TemporaryDirectory() as directory:
+            for filename in 'events.ndjson', 'events.ndjson.gz':
+                with self.subTest(filename=filename):
+                    filepath = join(directory, filename)
+                    exportevents(filepath)
+                    
+                    Event.delete().where(Event.path << self.paths).execute()
+                    importevents(filepath)
+                    self.assertEqual(count, Event.select().count())
+                    
+                    # Everything is known now, so importing again changes nothing
+                    importevents(filepath)
+                    self.assertEqual(count, Event.select().count())
+                    
+                    for path in self.paths:
+                        event = Event.get(Event.path == path)
+                        self.assertEqual({'body': f'Post at {path}'}, event.diff)
+                        self.assertEqual(['abraham@aaa'], event.authors)
+                        self.assertEqual(Event.PENDING, event.status)
+                        self.assertEqual(event.compute_content_hash(), event.content_hash)
+
+
+class TestHashEvents(AndreasTestCase):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.server: Server = Server.create(name='bbb')
+        content = dict(server='aaa', authors=['abraham@aaa'], path='/post1', diff={'body': 'Hello'},
+            signatures={'abraham@aaa': 'abcd'})
+        self.original: Event = Event.create(**content)
+        
+        # Bulk inserts don't compute the hash, just like an old database
+        duplicate_id = Event.insert(received_from=self.server, **content).execute()
+        hashevents()
+        self.duplicate: Event = Event.get_by_id(duplicate_id)
+    
+    def test_duplicate(self):
+        self.assertIsNone(self.duplicate.content_hash)
+        self.assertEqual(Event.DONE, self.duplicate.status)
+        self.assertEqual(self.original.id, self.duplicate.error['duplicate_of'])
+        self.assertEqual([self.server], [source.server for source in self.original.sources])
+    
+    def test_not_checked_again(self):
+        Event.update(status=Event.PENDING).where(Event.id == self.duplicate.id).execute()
+        hashevents()
+        self.assertEqual(Event.PENDING, Event.get_by_id(self.duplicate.id).status)
+
+
+class TestDedupeUsers(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        # Databases from before the unique indexes can contain duplicates
+        db.execute_sql(f'drop index {Server._meta.schema}.server_name')
+        db.execute_sql(f'drop index {User._meta.schema}.user_server_id_name')
+        
+        self.post = Post.create(server=self.server, path='/post1', data={'title': 'Hello', 'body': 'Hello'})
+        UserPostRelation.create(source=self.abraham, type='wrote', target=self.post)
+        
+        self.server2 = Server.create(name='aaa')
+        self.abraham2 = User.create(server=self.server2, name='abraham')
+        self.post2 = Post.create(server=self.server2, path='/post1', data={'body': 'Hello again'})
+        self.post3 = Post.create(server=self.server2, path='/post3')
+        UserPostRelation.create(source=self.abraham2, type='wrote', target=self.post2)
+        UserPostRelation.create(source=self.abraham2, type='wrote', target=self.post3)
+        self.abraham2_keypair = self.get_abraham2()
+        self.abraham2_keypair.user = self.abraham2
+        self.abraham2_keypair.save()
+        
+        dedupeusers()
+    
+    def test_duplicates_deleted(self):
+        self.assertEqual([self.server], list(Server.select().where(Server.name == 'aaa')))
+        self.assertEqual([self.abraham], list(User.select().where(User.name == 'abraham')))
+        self.assertEqual([self.post], list(Post.select().where(Post.path == '/post1')))
+    
+    def test_references_moved(self):
+        self.post.reload()
+        self.assertEqual({'title': 'Hello', 'body': 'Hello again'}, self.post.data)
+        self.assertEqual(self.server, Post.get_by_id(self.post3.id).server)
+        self.assertEqual(self.abraham, KeyPair.get_by_id(self.abraham2_keypair.id).user)
+        self.assertEqual(
+            [(self.abraham.id, self.post.id), (self.abraham.id, self.post3.id)],
+            [(r.source_id, r.target_id) for r in UserPostRelation.select().order_by(UserPostRelation.target)])
+    
+    def test_unique_indexes_created(self):
+        with self.assertRaises(IntegrityError), db.atomic():
+            Server.create(name='aaa')
\ No newline at end of file
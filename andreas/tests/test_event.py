@@ -0,0 +1,63 @@
+from andreas.models.event import Event, EventSource
+from andreas.models.server import Server
+from andreas.tests.andreastestcase import AndreasTestCase
+
+
+class TestReceive(AndreasTestCase):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.peer1: Server = Server.create(name='peer1')
+        self.peer2: Server = Server.create(name='peer2')
+    
+    def make_event(self, received_from: Server, body: str = 'Hello') -> Event:
+        return Event(received_from=received_from, server='aaa', authors=['abraham@aaa'], path='/post1',
+            diff={'body': body}, signatures={'abraham@aaa': 'abcd'})
+    
+    def test_new_event(self):
+        event, created = Event.receive(self.make_event(self.peer1))
+        self.assertTrue(created)
+        self.assertEqual(event, Event.get(Event.content_hash == event.compute_content_hash()))
+        self.assertEqual(Event.PENDING, Event.get(Event.id == event.id).status)
+    
+    def test_duplicates(self):
+        event, _ = Event.receive(self.make_event(self.peer1))
+        
+        for peer in self.peer2, self.peer2, self.peer1:
+            duplicate, created = Event.receive(self.make_event(peer))
+            self.assertFalse(created)
+            self.assertEqual(event, duplicate)
+        
+        self.assertEqual(1, Event.select().where(Event.path == '/post1').count())
+        sources = EventSource.select().where(EventSource.event == event)
+        self.assertEqual([self.peer2], [source.server for source in sources])
+    
+    def test_different_content(self):
+        event1, _ = Event.receive(self.make_event(self.peer1))
+        event2, created = Event.receive(self.make_event(self.peer1, body='Bye'))
+        self.assertTrue(created)
+        self.assertNotEqual(event1, event2)
+    
+    def test_receive_many(self):
+        known, _ = Event.receive(self.make_event(self.peer1))
+        
+        received = Event.receive_many([
+            self.make_event(self.peer2, body='Bye'),
+            self.make_event(self.peer2),
+            self.make_event(self.peer1, body='Bye'),
+        ])
+        new, _ = received[0]
+        self.assertEqual([(new, True), (known, False), (new, False)], received)
+        self.assertEqual(
+            [(known.id, self.peer2), (new.id, self.peer1)],
+            [(source.event_id, source.server) for source in EventSource.select().order_by(EventSource.event)])
+    
+    def test_save_duplicate(self):
+        event, _ = Event.receive(self.make_event(self.peer1))
+        
+        duplicate = self.make_event(self.peer2)
+        duplicate.save()
+        self.assertEqual(event.id, duplicate.id)
+        self.assertEqual(self.peer1, duplicate.received_from)
+        sources = EventSource.select().where(EventSource.event == event)
+        self.assertEqual([self.peer2], [source.server for source in sources])
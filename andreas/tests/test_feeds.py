@@ -0,0 +1,69 @@
+from typing import List
+
+from andreas.functions.feeds import author_feed, find_posts, global_feed, server_feed
+from andreas.models.post import Post
+from andreas.models.relations import UserPostRelation
+from andreas.models.server import Server
+from andreas.tests.andreastestcase import AndreasTestCaseWithKeyPair
+
+
+class TestFeeds(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.other_server: Server = Server.create(name='bbb')
+        
+        # All posts are modified in the same transaction, so they are ordered by id
+        self.posts: List[Post] = []
+        for i in range(5):
+            post = Post.create(server=self.server if i % 2 == 0 else self.other_server, path=f'/post{i}')
+            UserPostRelation.create(source=self.abraham if i < 3 else self.bernard, type='wrote', target=post)
+            self.posts.append(post)
+        UserPostRelation.create(source=self.bernard, type='wrote', target=self.posts[0])
+    
+    def test_global_feed(self):
+        first_page = global_feed(limit=3)
+        self.assertEqual(self.posts[:1:-1], first_page.posts)
+        
+        second_page = global_feed(limit=3, after=first_page.cursor)
+        self.assertEqual(self.posts[1::-1], second_page.posts)
+        self.assertIsNone(second_page.cursor)
+    
+    def test_server_feed(self):
+        page = server_feed(self.other_server)
+        self.assertEqual([self.posts[3], self.posts[1]], page.posts)
+    
+    def test_author_feed(self):
+        page = author_feed(self.bernard)
+        self.assertEqual([self.posts[4], self.posts[3], self.posts[0]], page.posts)
+    
+    def test_authors(self):
+        page = global_feed()
+        authors = {post: post.authors() for post in page.posts}
+        self.assertEqual([self.abraham, self.bernard], authors[self.posts[0]])
+        self.assertEqual([self.bernard], authors[self.posts[4]])
+
+
+class TestFindPosts(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.post1 = Post.create(server=self.server, path='/post1', data={'tags': ['Aaa', 'Bbb'], 'body': 'One'})
+        self.post2 = Post.create(server=self.server, path='/post2', data={'tags': ['Bbb'], 'body': 'Two'})
+        self.post3 = Post.create(server=self.server, path='/post3', data={'title': 'Three'})
+    
+    def test_contains(self):
+        self.assertEqual([self.post1], find_posts(contains={'tags': ['Aaa']}).posts)
+        self.assertEqual([self.post2, self.post1], find_posts(contains={'tags': ['Bbb']}).posts)
+        self.assertEqual([], find_posts(contains={'tags': ['Ccc']}).posts)
+    
+    def test_has_keys(self):
+        self.assertEqual([self.post2, self.post1], find_posts(has_keys=['tags', 'body']).posts)
+        self.assertEqual([self.post3], find_posts(has_keys=['title']).posts)
+    
+    def test_pagination(self):
+        first_page = find_posts(contains={'tags': ['Bbb']}, limit=1)
+        self.assertEqual([self.post2], first_page.posts)
+        second_page = find_posts(contains={'tags': ['Bbb']}, limit=1, after=first_page.cursor)
+        self.assertEqual([self.post1], second_page.posts)
+        self.assertIsNone(second_page.cursor)
\ No newline at end of file
@@ -0,0 +1,91 @@
+from andreas.db.invalidation import dispatch
+from andreas.models.keypair import PublicKeyCache, public_key_cache
+from andreas.tests.andreastestcase import AndreasTestCaseWithKeyPair
+
+
+class TestPublicKeyCache(AndreasTestCaseWithKeyPair):
+    def test_hits_and_misses(self):
+        cache = PublicKeyCache()
+        
+        with self.subTest('First access is a miss'):
+            keys = cache.get('abraham@aaa')
+            self.assertEqual([key.id for key in keys], [self.abraham_keypair.id])
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+        
+        with self.subTest('Second access is a hit'):
+            keys = cache.get('abraham@aaa')
+            self.assertEqual([key.id for key in keys], [self.abraham_keypair.id])
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+    
+    def test_by_fingerprint(self):
+        cache = PublicKeyCache()
+        key = ('abraham@aaa', self.abraham_keypair.fingerprint)
+        
+        with self.subTest('Uncached users are looked up by the fingerprint only'):
+            self.assertEqual([self.abraham_keypair.id], [k.id for k in cache.get_by_fingerprints([key]).values()])
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            self.assertEqual({}, cache.get_by_fingerprints([('bernard@aaa', self.abraham_keypair.fingerprint)]))
+        
+        with self.subTest('Cached users are served from the cache'):
+            cache.get('abraham@aaa')
+            self.assertEqual([self.abraham_keypair.id], [k.id for k in cache.get_by_fingerprints([key]).values()])
+            self.assertEqual(cache.hits, 1)
+    
+    def test_unknown_user(self):
+        self.assertEqual(PublicKeyCache().get('nobody@aaa'), [])
+        self.assertEqual(PublicKeyCache().get('nobody'), [])
+    
+    def test_eviction(self):
+        cache = PublicKeyCache(maxsize=1)
+        cache.get('abraham@aaa')
+        cache.get('bernard@aaa')
+        cache.get('abraham@aaa')
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+    
+    def test_invalidated_on_save(self):
+        old_keypair = self.abraham_keypair
+        public_key_cache.get('abraham@aaa')
+        self.load_abraham2()
+        
+        keys = public_key_cache.get('abraham@aaa')
+        self.assertEqual(set(key.id for key in keys), {old_keypair.id, self.abraham_keypair.id})
+    
+    def test_invalidated_on_delete(self):
+        public_key_cache.get('bernard@aaa')
+        self.bernard_keypair.delete_instance()
+        self.assertEqual(public_key_cache.get('bernard@aaa'), [])
+    
+    def test_invalidated_by_notification(self):
+        public_key_cache.get('abraham@aaa')
+        public_key_cache.get('bernard@aaa')
+        dispatch({'table': 'keypair', 'user': 'abraham@aaa'})
+        
+        hits = public_key_cache.hits
+        public_key_cache.get('bernard@aaa')
+        self.assertEqual(public_key_cache.hits, hits + 1)
+        
+        misses = public_key_cache.misses
+        public_key_cache.get('abraham@aaa')
+        self.assertEqual(public_key_cache.misses, misses + 1)
+    
+    def test_invalidated_by_rename(self):
+        public_key_cache.get('abraham@aaa')
+        public_key_cache.get('bernard@aaa')
+        
+        with self.subTest('Other changes of a server keep the cache'):
+            dispatch({'table': 'server', 'id': self.server.id, 'name': 'aaa', 'old_name': 'aaa'})
+            misses = public_key_cache.misses
+            public_key_cache.get('abraham@aaa')
+            self.assertEqual(public_key_cache.misses, misses)
+        
+        with self.subTest('Renamed user'):
+            dispatch({'table': 'user', 'id': self.abraham.id, 'user': 'abraham@aaa'})
+            misses = public_key_cache.misses
+            public_key_cache.get_many(['abraham@aaa', 'bernard@aaa'])
+            self.assertEqual(public_key_cache.misses, misses + 1)
+        
+        with self.subTest('Renamed server'):
+            dispatch({'table': 'server', 'id': self.server.id, 'name': 'zzz', 'old_name': 'aaa'})
+            misses = public_key_cache.misses
+            public_key_cache.get_many(['abraham@aaa', 'bernard@aaa'])
+            self.assertEqual(public_key_cache.misses, misses + 2)
\ No newline at end of file
@@ -0,0 +1,71 @@
+from andreas.models.event import Event
+from andreas.models.post import Post
+from andreas.models.relations import UserPostRelation
+from andreas.models.server import Server
+from andreas.tests.andreastestcase import AndreasTestCase, AndreasTestCaseWithKeyPair
+
+
+class TestMergeData(AndreasTestCase):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.server: Server = Server.create(name='aaa')
+        self.post: Post = Post.create(server=self.server, path='/post1', data={
+            'title': 'Hello',
+            'subtitle': 'A hello world post',
+            'body': 'Hello, World!',
+        })
+    
+    def test_existing_post(self):
+        post_id = Post.merge_data(self.server, '/post1', {
+            'title': 'Hello (updated)',
+            'subtitle': None,
+            'tags': ['Aaa'],
+        })
+        self.assertEqual(post_id, self.post.id)
+        
+        self.post.reload()
+        self.assertEqual(self.post.data, {
+            'title': 'Hello (updated)',
+            'body': 'Hello, World!',
+            'tags': ['Aaa'],
+        })
+    
+    def test_new_post(self):
+        post_id = Post.merge_data(self.server.id, '/post2', {'body': 'New post', 'title': None})
+        post = Post.get(Post.id == post_id)
+        self.assertEqual(post.data, {'body': 'New post'})
+        self.assertIsNotNone(post.created)
+        self.assertIsNotNone(post.modified)
+    
+    def test_last_event(self):
+        event = Event.create(server='aaa', authors=[], path='/post1', diff={'body': 'Edited'})
+        Post.merge_data(self.server, '/post1', event.diff, event)
+        Post.merge_data(self.server, '/post1', {'title': None})
+        
+        # Changes that don't come from an event keep the last event
+        self.post.reload()
+        self.assertEqual(event.id, self.post.last_event_id)
+
+
+class TestAuthors(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.post1: Post = Post.create(server=self.server, path='/post1')
+        self.post2: Post = Post.create(server=self.server, path='/post2')
+        UserPostRelation.create(source=self.abraham, type='wrote', target=self.post1)
+        UserPostRelation.create(source=self.bernard, type='wrote', target=self.post1)
+        UserPostRelation.create(source=self.bernard, type='wrote', target=self.post2)
+    
+    def test_without_prefetch(self):
+        self.assertEqual([self.abraham, self.bernard], self.post1.authors())
+    
+    def test_prefetch(self):
+        posts = Post.prefetch_authors(Post.select().where(Post.id << [self.post1.id, self.post2.id]).order_by(Post.id))
+        
+        # Prefetched authors are used even after the relations change
+        UserPostRelation.delete().execute()
+        self.assertEqual([self.abraham, self.bernard], posts[0].authors())
+        self.assertEqual([self.bernard], posts[1].authors())
+        self.assertEqual('abraham@aaa', str(posts[0].authors()[0]))
\ No newline at end of file
@@ -1,6 +1,7 @@
+from datetime import datetime
 from typing import List, Union
 
-from andreas.functions.process_event import UnauthorizedAction, process_event
+from andreas.functions.process_event import MissingReference, UnauthorizedAction, process_event, process_events
 from andreas.functions.verifying import sign_post
 from andreas.models.event import Event
 from andreas.models.keypair import KeyPair
@@ -262,4 +263,191 @@ class TestRevalidateWithNewKey(AndreasTestCaseWithKeyPair):
                 self.assertEqual(len(signatures), 1)
                 self.assertEqual(signatures[0].keypair, self.abraham_keypair)
                 self.assertEqual(signatures[0].post, post)
-                self.assertEqual(self.event.signatures['abraham@aaa'], signatures[0].data.hex())
\ No newline at end of file
+                self.assertEqual(self.event.signatures['abraham@aaa'], signatures[0].data.hex())
+
+
+class TestProcessEvents(AndreasTestCaseWithKeyPair):
+    """
+    Process several events at once and make sure that an unauthorized one doesn't prevent the others from applying.
+    """
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.events: List[Event] = []
+        for path, keypair in ('/post1', self.abraham_keypair), ('/post2', self.bernard_keypair), ('/post3', self.abraham_keypair):
+            event = Event()
+            event.server = 'aaa'
+            event.authors = ['abraham@aaa']
+            event.path = path
+            event.diff = {
+                'body': f'Post at {path}.',
+            }
+            event.signatures = {
+                repr(keypair.user): sign_post(event, keypair).hex(),
+            }
+            event.save()
+            self.events.append(event)
+        
+        self.errors = process_events(self.events, batch_size=2)
+    
+    def test_errors(self):
+        self.assertEqual(list(self.errors.keys()), [self.events[1]])
+        self.assertIsInstance(self.errors[self.events[1]], UnauthorizedAction)
+    
+    def test_posts_created(self):
+        for event in self.events[0], self.events[2]:
+            with self.subTest(path=event.path):
+                post: Post = Post.select().join(Server).where(Server.name == 'aaa', Post.path == event.path).get()
+                self.assertEqual(event.diff, post.data)
+    
+    def test_post_not_created(self):
+        with self.assertRaises(Post.DoesNotExist):
+            Post.select().join(Server).where(Server.name == 'aaa', Post.path == '/post2').get()
+    
+    def test_signatures_saved(self):
+        self.assertEqual(Signature.select().where(Signature.event << self.events).count(), 3)
+
+
+class TestMissingReferences(AndreasTestCaseWithKeyPair):
+    """
+    Events that refer to an unknown server, user or parent post are reported without stopping the others.
+    The same goes for authors that are not even formatted like ``user@server``.
+    """
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.events: List[Event] = []
+        for server, author, path, parent in (
+            ('aaa', 'abraham@aaa', '/post1', None),
+            ('zzz', 'abraham@aaa', '/post2', None),
+            ('aaa', 'zachary@aaa', '/post3', None),
+            ('aaa', 'abraham@aaa', '/post4', 'aaa/missing'),
+            ('aaa', 'abraham', '/post5', None),
+        ):
+            event = Event()
+            event.server = server
+            event.authors = [author]
+            event.path = path
+            event.parent = parent
+            event.diff = {
+                'body': f'Post at {path}.',
+            }
+            event.signatures = {
+                author: sign_post(event, self.abraham_keypair).hex(),
+            }
+            event.save()
+            self.events.append(event)
+        
+        self.errors = process_events(self.events)
+    
+    def test_errors(self):
+        self.assertEqual(set(self.errors.keys()), set(self.events[1:]))
+        for event in self.events[1:]:
+            with self.subTest(path=event.path):
+                self.assertIsInstance(self.errors[event], MissingReference)
+    
+    def test_post_created(self):
+        post: Post = Post.select().join(Server).where(Server.name == 'aaa', Post.path == '/post1').get()
+        self.assertEqual(post.data, {'body': 'Post at /post1.'})
+    
+    def test_posts_not_created(self):
+        self.assertEqual(Post.select().where(Post.path << ['/post2', '/post3', '/post4', '/post5']).count(), 0)
+
+
+class TestSignatureWithKeyFingerprint(AndreasTestCaseWithKeyPair):
+    """
+    Signatures that specify a keypair fingerprint should be checked with that keypair only.
+    """
+    def setUpSafe(self):
+        super().setUpSafe()
+        self.load_abraham2()
+    
+    def create_event(self, path: str, fingerprint: str) -> Event:
+        event = Event()
+        event.server = 'aaa'
+        event.authors = ['abraham@aaa']
+        event.path = path
+        event.diff = {
+            'body': 'Signed with a known key.',
+        }
+        event.signatures = {
+            'abraham@aaa': {
+                'signature': sign_post(event, self.abraham_keypair).hex(),
+                'key': fingerprint,
+            },
+        }
+        event.save()
+        return event
+    
+    def test_fingerprint_saved(self):
+        self.assertEqual(self.abraham_keypair.fingerprint, KeyPair.compute_fingerprint(self.abraham_keypair.pubkey))
+    
+    def test_correct_fingerprint(self):
+        event = self.create_event('/post1', self.abraham_keypair.fingerprint)
+        process_event(event)
+        
+        signature: Signature = Signature.select().where(Signature.event == event).get()
+        self.assertEqual(signature.keypair, self.abraham_keypair)
+    
+    def test_wrong_fingerprint(self):
+        event = self.create_event('/post2', self.bernard_keypair.fingerprint)
+        with self.assertRaises(UnauthorizedAction):
+            process_event(event)
+
+
+class TestRelationsNotDuplicated(AndreasTestCaseWithKeyPair):
+    """
+    Editing the same post several times must not create the same relations again.
+    """
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        for body in 'First version.', 'Second version.':
+            event = Event()
+            event.server = 'aaa'
+            event.authors = ['abraham@aaa']
+            event.path = '/post1'
+            event.diff = {
+                'body': body,
+            }
+            event.signatures = {
+                'abraham@aaa': sign_post(event, self.abraham_keypair).hex(),
+            }
+            event.save()
+            process_event(event)
+    
+    def test_single_relation(self):
+        post: Post = Post.select().join(Server).where(Server.name == 'aaa', Post.path == '/post1').get()
+        self.assertEqual(post.data, {'body': 'Second version.'})
+        self.assertEqual(post.incoming_relations_user_post.count(), 1)
+
+
+class TestOrderByReceived(AndreasTestCaseWithKeyPair):
+    """
+    Events given in the wrong order should be applied in the order they were received.
+    """
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.events: List[Event] = []
+        for day, body in (1, 'First version.'), (2, 'Second version.'):
+            event = Event()
+            event.received = datetime(2018, 1, day)
+            event.server = 'aaa'
+            event.authors = ['abraham@aaa']
+            event.path = '/post1'
+            event.diff = {
+                'body': body,
+            }
+            event.signatures = {
+                'abraham@aaa': sign_post(event, self.abraham_keypair).hex(),
+            }
+            event.save()
+            self.events.append(event)
+        
+        self.errors = process_events(reversed(self.events), order_by_received=True)
+    
+    def test_all(self):
+        self.assertEqual(self.errors, {})
+        post: Post = Post.select().join(Server).where(Server.name == 'aaa', Post.path == '/post1').get()
+        self.assertEqual(post.data, {'body': 'Second version.'})
@@ -1,6 +1,6 @@
 from typing import Iterable
 
-from andreas.functions.querying import get_post
+from andreas.functions.querying import get_post, get_post_by_identifier, get_posts_by_identifiers
 from andreas.models.post import Post
 from andreas.models.server import Server
 from andreas.models.user import User
@@ -46,4 +46,16 @@ class TestQuerying(AndreasTestCase):
         for server in (self.server_a, self.server_a.id, self.server_a.name):
             with self.subTest(server_param_type=type(server).__name__):
                 with self.assertRaises(Post.DoesNotExist):
-                    get_post(self.server_a, '3')
\ No newline at end of file
+                    get_post(self.server_a, '3')
+    
+    def test_identifiers(self):
+        posts = get_posts_by_identifiers(['A/post1', 'B/post3', 'A/missing', 'C/post1'])
+        self.assertEqual({'A/post1', 'B/post3'}, set(posts))
+        self.assertEqual('Server A, Post #1', posts['A/post1'].data['body'])
+        self.assertEqual('Server B, Post #3', posts['B/post3'].data['body'])
+    
+    def test_identifiers_with_slashes(self):
+        post = Post.create(server=self.server_a, path='/blog/2018/post', data={'body': 'Nested'})
+        
+        self.assertEqual(post, get_post_by_identifier('A/blog/2018/post'))
+        self.assertEqual({'A/blog/2018/post': post}, get_posts_by_identifiers(['A/blog/2018/post']))
\ No newline at end of file
@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+from andreas.functions.process_event import process_events
+from andreas.functions.queue import claim_events, process_queue, requeue_events
+from andreas.functions.verifying import sign_post
+from andreas.models.event import Event
+from andreas.models.post import Post
+from andreas.models.server import Server
+from andreas.tests.andreastestcase import AndreasTestCaseWithKeyPair
+
+
+class TestQueue(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        # Events from other tests or from real usage shouldn't interfere
+        Event.update(status=Event.DONE).execute()
+        
+        self.events = []
+        for path, keypair in ('/post1', self.abraham_keypair), ('/post2', self.bernard_keypair):
+            event = Event()
+            event.server = 'aaa'
+            event.authors = ['abraham@aaa']
+            event.path = path
+            event.diff = {
+                'body': f'Post at {path}.',
+            }
+            event.signatures = {
+                repr(keypair.user): sign_post(event, keypair).hex(),
+            }
+            event.save()
+            self.events.append(event)
+    
+    def test_new_events_are_pending(self):
+        for event in self.events:
+            event.reload()
+            self.assertEqual(event.status, Event.PENDING)
+    
+    def test_claim(self):
+        claimed = claim_events(1)
+        self.assertEqual([event.id for event in claimed], [self.events[0].id])
+        self.assertEqual(claimed[0].status, Event.PROCESSING)
+        self.assertEqual(claimed[0].attempts, 1)
+        
+        claimed = claim_events(10)
+        self.assertEqual([event.id for event in claimed], [self.events[1].id])
+    
+    def test_claim_in_post_order(self):
+        edit = Event(server='aaa', authors=['abraham@aaa'], path='/post1', diff={'body': 'Edited.'})
+        edit.save()
+        
+        with self.subTest('Blocked by an event claimed by another worker'):
+            claim_events(1)
+            self.assertEqual([event.id for event in claim_events(10)], [self.events[1].id])
+        
+        with self.subTest('Claimed after the earlier event is finished'):
+            Event.update(status=Event.DONE).where(Event.id == self.events[0].id).execute()
+            self.assertEqual([event.id for event in claim_events(10)], [edit.id])
+    
+    def test_process_queue(self):
+        self.assertEqual(process_queue(10), 2)
+        self.assertEqual(process_queue(10), 0)
+        
+        accepted, rejected = (Event.get(Event.id == event.id) for event in self.events)
+        
+        with self.subTest('Accepted event'):
+            self.assertEqual(accepted.status, Event.DONE)
+            Post.select().join(Server).where(Server.name == 'aaa', Post.path == '/post1').get()
+        
+        with self.subTest('Rejected event'):
+            self.assertEqual(rejected.status, Event.REJECTED)
+            self.assertEqual(rejected.error['required_users'], ['abraham@aaa'])
+            self.assertEqual(rejected.error['message'], 'Missing authorization by abraham@aaa.')
+    
+    def test_process_events_records_status(self):
+        process_events(self.events)
+        self.assertEqual([Event.DONE, Event.REJECTED], [event.status for event in self.events])
+        for event in self.events:
+            self.assertEqual(event.status, Event.get(Event.id == event.id).status)
+    
+    def test_retry_backoff(self):
+        self.events[0].server = 'unknown'
+        self.events[0].save()
+        process_queue(10)
+        self.assertEqual(Event.RETRY, Event.get(Event.id == self.events[0].id).status)
+        
+        with self.subTest('Not claimed before the backoff'):
+            self.assertEqual([], claim_events(10))
+        with self.subTest('Claimed after the backoff'):
+            claimed = claim_events(10, retry_backoff=timedelta(0))
+            self.assertEqual([event.id for event in claimed], [self.events[0].id])
+    
+    def test_failed_and_requeued(self):
+        claim_events(10)
+        Event.update(status=Event.RETRY).where(Event.id == self.events[0].id).execute()
+        self.assertEqual([], claim_events(10, max_attempts=1, retry_backoff=timedelta(0)))
+        self.assertEqual(Event.FAILED, Event.get(Event.id == self.events[0].id).status)
+        
+        self.assertEqual(1, requeue_events())
+        event = Event.get(Event.id == self.events[0].id)
+        self.assertEqual((Event.PENDING, 0), (event.status, event.attempts))
@@ -0,0 +1,73 @@
+from time import monotonic
+
+from andreas.functions.process_event import process_events
+from andreas.functions.replay import _reset_to_snapshots, replay_partition
+from andreas.functions.snapshots import take_snapshots
+from andreas.functions.verifying import sign_post
+from andreas.models.event import Event
+from andreas.models.post import Post
+from andreas.models.relations import PostPostRelation
+from andreas.models.replay import ReplayCheckpoint
+from andreas.tests.andreastestcase import AndreasTestCaseWithKeyPair
+
+
+class TestReplay(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        def create_event(path: str, data: dict, parent: str = None) -> Event:
+            event = Event(server='aaa', authors=['abraham@aaa'], path=path, diff=data, parent=parent)
+            event.signatures = {'abraham@aaa': sign_post(event, self.abraham_keypair, data=data).hex()}
+            event.save()
+            return event
+        
+        create_event('/post1', {'body': 'First'})
+        create_event('/post2', {'body': 'Comment'}, parent='aaa/post1')
+        self.orphan = create_event('/post3', {'body': 'Comment to nothing'}, parent='aaa/missing')
+        process_events(Event.select().order_by(Event.id))
+        
+        # Pretend that the state got corrupted
+        Post.update(data={}, last_event=None).execute()
+    
+    def test_replay(self):
+        replay_partition(0, 1, max_wait=0)
+        
+        self.assertEqual({'body': 'First'}, Post.get(Post.path == '/post1').data)
+        self.assertEqual({'body': 'Comment'}, Post.get(Post.path == '/post2').data)
+        self.assertEqual(1, PostPostRelation.select().count())
+        
+        # The comment to a missing post was never applied, so it isn't replayed
+        checkpoint = ReplayCheckpoint.get(ReplayCheckpoint.partition == 0)
+        self.assertEqual(2, checkpoint.processed)
+        self.assertEqual(0, checkpoint.skipped)
+    
+    def test_no_wait_for_unknown_post(self):
+        Event.update(status=Event.DONE).where(Event.id == self.orphan.id).execute()
+        
+        # Nobody is going to create the missing post, so the event is skipped without waiting
+        started = monotonic()
+        replay_partition(0, 1, max_wait=60)
+        self.assertLess(monotonic() - started, 30)
+        self.assertEqual(1, ReplayCheckpoint.get(ReplayCheckpoint.partition == 0).skipped)
+    
+    def test_resume(self):
+        replay_partition(0, 1, max_wait=0)
+        Post.update(data={}).execute()
+        
+        # Everything was already replayed, so nothing happens
+        replay_partition(0, 1, max_wait=0)
+        self.assertEqual({}, Post.get(Post.path == '/post1').data)
+    
+    def test_from_snapshots(self):
+        replay_partition(0, 1, max_wait=0)
+        take_snapshots(min_events=1)
+        ReplayCheckpoint.delete().execute()
+        Post.update(data={}).execute()
+        
+        # Posts are restored from the snapshots, and there is nothing to replay after them
+        _reset_to_snapshots()
+        replay_partition(0, 1, max_wait=0)
+        self.assertEqual({'body': 'First'}, Post.get(Post.path == '/post1').data)
+        self.assertEqual({'body': 'Comment'}, Post.get(Post.path == '/post2').data)
+        self.assertEqual(1, PostPostRelation.select().count())
+        self.assertEqual(0, ReplayCheckpoint.get(ReplayCheckpoint.partition == 0).processed)
@@ -0,0 +1,48 @@
+from andreas.functions.search import search_posts
+from andreas.models.post import Post
+from andreas.models.server import Server
+from andreas.tests.andreastestcase import AndreasTestCase
+
+
+class TestSearch(AndreasTestCase):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.server: Server = Server.create(name='aaa')
+        self.post1 = Post.create(server=self.server, path='/post1', data={'title': 'Apples', 'body': 'Red and green'})
+        self.post2 = Post.create(server=self.server, path='/post2', data={'title': 'Fruits', 'body': 'Apples and pears'})
+        self.post3 = Post.create(server=self.server, path='/post3', data={'title': 'Vegetables', 'body': 'Green beans'})
+    
+    def test_ranking(self):
+        # Matches in titles are more important
+        self.assertEqual([self.post1, self.post2], search_posts('apples').posts)
+        self.assertEqual([self.post3, self.post1], search_posts('green').posts)
+        self.assertEqual([], search_posts('bananas').posts)
+    
+    def test_all_words(self):
+        self.assertEqual([self.post3], search_posts('green beans').posts)
+    
+    def test_data_update(self):
+        Post.merge_data(self.server, '/post3', {'body': 'Bananas'})
+        self.assertEqual([self.post3], search_posts('bananas').posts)
+        self.assertEqual([self.post1], search_posts('green').posts)
+    
+    def test_pagination(self):
+        first_page = search_posts('apples', limit=1)
+        self.assertEqual([self.post1], first_page.posts)
+        second_page = search_posts('apples', limit=1, after=first_page.cursor)
+        self.assertEqual([self.post2], second_page.posts)
+        self.assertIsNone(second_page.cursor)
+    
+    def test_pagination_with_equal_ranks(self):
+        same = [Post.create(server=self.server, path=f'/same{i}', data={'title': 'Pears', 'body': 'Pears'}) for i in range(3)]
+        
+        found = []
+        cursor = None
+        for _ in range(10):
+            page = search_posts('pears', limit=1, after=cursor)
+            found.extend(page.posts)
+            cursor = page.cursor
+            if cursor is None:
+                break
+        self.assertEqual(found, list(reversed(same)) + [self.post2])
\ No newline at end of file
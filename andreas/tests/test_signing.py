@@ -2,7 +2,7 @@ import json
 
 import rsa
 
-from andreas.functions.verifying import sign_post, verify_post
+from andreas.functions.verifying import VerificationExecutor, sign_post, verify_post, verify_signatures
 from andreas.models.event import Event
 from andreas.models.post import Post
 from andreas.models.relations import UserPostRelation
@@ -76,4 +76,47 @@ class TestSigningEventWithCustomData(_TestSigning):
         self.assertEqual(sign_post(self.event, self.abraham_keypair, data={'foo': 'bar', 'bar': 'baz'}), self.expected)
     
     def test_verify(self):
-        verify_post(self.event, 'abraham@aaa', self.expected, data={'foo': 'bar', 'bar': 'baz'})
\ No newline at end of file
+        verify_post(self.event, 'abraham@aaa', self.expected, data={'foo': 'bar', 'bar': 'baz'})
+
+
+class TestVerificationExecutor(_TestSigning):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.data = json.dumps({
+            'server': 'aaa',
+            'path': '/post1',
+            'authors': ['abraham@aaa'],
+            'data': {'foo': 'bar', 'bar': 'baz'},
+        }, sort_keys=True).encode()
+        
+        abraham = (self.abraham_keypair.id, self.abraham_keypair.n, self.abraham_keypair.e)
+        bernard = (self.bernard_keypair.id, self.bernard_keypair.n, self.bernard_keypair.e)
+        self.jobs = [
+            (self.data, {'abraham@aaa': self.expected}, {'abraham@aaa': [abraham]}),
+            (self.data, {'abraham@aaa': self.expected, 'bernard@aaa': self.expected}, {
+                'abraham@aaa': [bernard, abraham],
+                'bernard@aaa': [bernard],
+            }),
+            (self.data, {'abraham@aaa': self.expected}, {}),
+        ]
+        self.expected_results = [
+            {'abraham@aaa': abraham[0]},
+            {'abraham@aaa': abraham[0], 'bernard@aaa': None},
+            {'abraham@aaa': None},
+        ]
+    
+    def test_synchronous(self):
+        self.assertEqual(VerificationExecutor(0).verify(self.jobs), self.expected_results)
+    
+    def test_pool(self):
+        executor = VerificationExecutor(2, chunksize=1)
+        try:
+            self.assertEqual(executor.verify(self.jobs), self.expected_results)
+        finally:
+            executor.shutdown()
+    
+    def test_wrong_data(self):
+        abraham = (self.abraham_keypair.id, self.abraham_keypair.n, self.abraham_keypair.e)
+        results = verify_signatures(self.data + b' ', {'abraham@aaa': self.expected}, {'abraham@aaa': [abraham]})
+        self.assertEqual(results, {'abraham@aaa': None})
\ No newline at end of file
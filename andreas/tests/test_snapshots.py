@@ -0,0 +1,72 @@
+from typing import Dict, List
+
+from andreas.functions.process_event import process_events
+from andreas.functions.snapshots import post_as_of, rebuild_post, take_snapshots
+from andreas.functions.verifying import sign_post
+from andreas.models.event import Event
+from andreas.models.post import Post
+from andreas.models.snapshot import PostSnapshot
+from andreas.tests.andreastestcase import AndreasTestCaseWithKeyPair
+
+
+class TestSnapshots(AndreasTestCaseWithKeyPair):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.data: Dict = {}
+        self.events: List[Event] = []
+        for diff in {'title': 'Hello'}, {'body': 'World'}, {'title': None, 'tags': ['Aaa']}:
+            self.apply(diff)
+        self.post: Post = Post.get(Post.path == '/post1')
+    
+    def apply(self, diff: Dict):
+        for key, value in diff.items():
+            if value is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+        event = Event(server='aaa', authors=['abraham@aaa'], path='/post1', diff=diff)
+        event.signatures = {'abraham@aaa': sign_post(event, self.abraham_keypair, data=self.data).hex()}
+        event.save()
+        process_events([event])
+        self.events.append(event)
+    
+    def test_without_snapshots(self):
+        self.assertEqual({'title': 'Hello'}, post_as_of(self.post, self.events[0].id).data)
+        self.assertEqual({'title': 'Hello', 'body': 'World'}, post_as_of(self.post, self.events[1].id).data)
+        
+        state = post_as_of(self.post)
+        self.assertEqual({'body': 'World', 'tags': ['Aaa']}, state.data)
+        self.assertEqual(['abraham@aaa'], state.authors)
+        self.assertEqual(self.events[2].id, state.event_id)
+    
+    def test_take_snapshots(self):
+        self.assertEqual(0, take_snapshots(min_events=4))
+        self.assertEqual(1, take_snapshots(min_events=3))
+        self.assertEqual(0, take_snapshots(min_events=1))
+        
+        snapshot = PostSnapshot.get(PostSnapshot.post == self.post)
+        self.assertEqual(self.events[2].id, snapshot.event_id)
+        self.assertEqual({'body': 'World', 'tags': ['Aaa']}, snapshot.data)
+        self.assertEqual(['abraham@aaa'], snapshot.authors)
+    
+    def test_start_from_snapshot(self):
+        take_snapshots(min_events=1)
+        self.apply({'body': 'Everyone'})
+        
+        # Mark the snapshot to see that it is used instead of the events before it
+        PostSnapshot.update(data={'body': 'World', 'tags': ['Aaa'], 'from_snapshot': True}).execute()
+        
+        self.assertEqual({'title': 'Hello', 'body': 'World'}, post_as_of(self.post, self.events[1].id).data)
+        self.assertEqual(
+            {'body': 'Everyone', 'tags': ['Aaa'], 'from_snapshot': True},
+            post_as_of(self.post).data)
+    
+    def test_rebuild_post(self):
+        take_snapshots(min_events=1)
+        self.apply({'body': 'Everyone'})
+        Post.update(data={}).execute()
+        
+        rebuild_post(self.post)
+        self.post.reload()
+        self.assertEqual({'body': 'Everyone', 'tags': ['Aaa']}, self.post.data)
\ No newline at end of file
@@ -0,0 +1,41 @@
+from andreas.db.model import UnitOfWork
+from andreas.models.post import Post
+from andreas.models.relations import PostPostRelation, UserPostRelation
+from andreas.models.server import Server
+from andreas.models.user import User
+from andreas.tests.andreastestcase import AndreasTestCase
+
+
+class TestUnitOfWork(AndreasTestCase):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.server: Server = Server.create(name='aaa')
+        self.users = [User.create(server=self.server, name=f'user{i}') for i in range(3)]
+        self.parent: Post = Post.create(server=self.server, path='/post1')
+        
+        self.post = Post(server=self.server, path='/post1#c1')
+        with UnitOfWork() as self.unit_of_work:
+            for user in self.users:
+                UserPostRelation.create_after(self.post, source=user, type='wrote', target=self.post)
+            PostPostRelation.create_after(self.post, source=self.post, type='comments', target=self.parent)
+            self.post.save()
+            self.count_before_flush = UserPostRelation.select().where(UserPostRelation.target == self.post).count()
+    
+    def test_nothing_saved_before_flush(self):
+        self.assertEqual(self.count_before_flush, 0)
+    
+    def test_relations_created(self):
+        self.assertEqual(
+            set(rel.source_id for rel in UserPostRelation.select().where(UserPostRelation.target == self.post)),
+            set(user.id for user in self.users))
+        PostPostRelation.get(
+            PostPostRelation.source == self.post,
+            PostPostRelation.type == 'comments',
+            PostPostRelation.target == self.parent)
+    
+    def test_outside_unit_of_work(self):
+        post = Post(server=self.server, path='/post2')
+        UserPostRelation.create_after(post, source=self.users[0], type='wrote', target=post)
+        post.save()
+        self.assertEqual(UserPostRelation.select().where(UserPostRelation.target == post).count(), 1)
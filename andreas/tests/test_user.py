@@ -1,3 +1,4 @@
+from andreas.functions.resolving import Resolver
 from andreas.models.server import Server
 from andreas.models.user import User
 from andreas.tests.andreastestcase import AndreasTestCase
@@ -36,4 +37,33 @@ class TestUser(AndreasTestCase):
             User.from_string('user3@aaa')
     
     def test_create_user(self):
-        self.assertIsNotNone(User.from_string('user3@aaa', create=True))
\ No newline at end of file
+        self.assertIsNotNone(User.from_string('user3@aaa', create=True))
+    
+    def test_from_strings(self):
+        users = User.from_strings(['user1@aaa', 'user3@bbb', 'user3@aaa'])
+        self.assertEqual({k: v.id for k, v in users.items()}, {'user1@aaa': self.user_a1.id, 'user3@bbb': self.user_b3.id})
+    
+    def test_from_strings_create(self):
+        users = User.from_strings(['user1@aaa', 'user3@aaa', 'user1@ccc'], create=True)
+        self.assertEqual(users['user1@aaa'].id, self.user_a1.id)
+        self.assertEqual(repr(users['user3@aaa']), 'user3@aaa')
+        self.assertEqual(repr(users['user1@ccc']), 'user1@ccc')
+
+
+class TestResolver(AndreasTestCase):
+    def setUpSafe(self):
+        super().setUpSafe()
+        
+        self.server: Server = Server.create(name='aaa')
+        self.user: User = User.create(server=self.server, name='user1')
+    
+    def test_identity(self):
+        resolver = Resolver()
+        first = resolver.users(['user1@aaa'])['user1@aaa']
+        second = resolver.users(['user1@aaa'])['user1@aaa']
+        self.assertIs(first, second)
+        self.assertIs(resolver.servers(['aaa'])['aaa'], first.server)
+    
+    def test_non_existent_user(self):
+        with self.assertRaises(User.DoesNotExist):
+            Resolver().users(['user1@aaa', 'user2@aaa'])
@@ -6,7 +6,10 @@ from os import walk
 from os.path import relpath, splitext
 
 from andreas.app import app
-from andreas.commands.dbcommands import dropdb, populatedb, resetdb, updatedb
+from andreas.commands.dbcommands import (deduperelations, dedupeusers, dropdb, exportevents, fingerprintkeys,
+    hashevents, importevents, populatedb, reindexsearch, repaircounters, replayevents, resetdb, snapshotposts, updatedb)
+from andreas.commands.workercommands import requeue, worker
+from andreas.db.invalidation import start_listener
 
 for dirpath, dirnames, filenames in walk(app.root_path + '/andreas'):
     for filename in filenames:
@@ -21,9 +24,22 @@ if __name__ == '__main__':
             updatedb,
             dropdb,
             resetdb,
+            fingerprintkeys,
+            hashevents,
+            deduperelations,
+            dedupeusers,
+            repaircounters,
+            reindexsearch,
+            exportevents,
+            importevents,
+            replayevents,
+            snapshotposts,
+            worker,
+            requeue,
         ]
         for func in functions:
             if func.__name__ == sys.argv[1]:
                 exit(func(*sys.argv[2:]))
     
+    start_listener()
     app.run()
\ No newline at end of file